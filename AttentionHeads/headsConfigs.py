@@ -16,6 +16,8 @@ fixed_config = {
     "max_steps": 200000,
     "save_steps": 200000,
     "log_steps": 500,
+    "validation_data_paths": ["your/path/to/validation.arrow"],  # held-out series, eval_loss in LearningCurves
+    "validation_steps": 10000,
     "optim": "adamw_torch_fused",
     "num_samples": 20,
     "shuffle_buffer_length": 100000,
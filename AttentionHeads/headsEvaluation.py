@@ -67,10 +67,16 @@ def get_model_version_id(config_id, training_step):
         (run_id, training_step)
     )
     existing_version = cursor.fetchone()
+    # Runs ended early by the stopping rule of train.py have no later model versions
+    cursor.execute("SELECT training_step, reason FROM EarlyStops WHERE run_id = ?", (run_id,))
+    early_stop = cursor.fetchone()
     connection.close()
     
     if existing_version:
         return existing_version[0]
+    elif early_stop:
+        print(f"Skipping run_id {run_id}: stopped early at step {early_stop[0]} ({early_stop[1]}).")
+        sys.exit(0)
     else:
         print(f"Error: No ModelVersion found for run_id {run_id} and training_step {training_step}.")
         sys.exit(1)
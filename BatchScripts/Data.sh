@@ -6,7 +6,7 @@
 #SBATCH --cpus-per-task=4
 #SBATCH --partition=alpha
 #SBATCH --gres=gpu:1
-#SBATCH --mem=120GB
+#SBATCH --mem=16GB
 #SBATCH -A p_automl
 #SBATCH --job-name=Data
 #SBATCH --output=data%j.out
@@ -21,7 +21,9 @@ echo "Start"
 
 cd path/to/script
 
-python3 getTrainingData.py
+# Streaming conversion (default), memory is bounded by --chunk-size
+# If the job hits the time limit, resubmit it: the conversion resumes from the last committed chunk
+python3 getTrainingData.py --dataset-name training_corpus_tsmixup_10m --output-path your/path/to/training_mix.arrow
 
 echo "Finish"
 exit
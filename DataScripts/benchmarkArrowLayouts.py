@@ -0,0 +1,120 @@
+import itertools
+import time
+from pathlib import Path
+from typing import List
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import typer
+from gluonts.dataset.arrow.dec import ArrowDecoder
+from gluonts.dataset.common import FileDataset, ProcessDataEntry
+from getTrainingData import convert_to_arrow_streaming, iter_batch_targets
+
+app = typer.Typer(pretty_exceptions_enable=False)
+
+
+def iter_source_targets(source_path: Path, num_series: int):
+    """Streams the first `num_series` targets (all if 0) of an already converted Arrow file."""
+    with pa.memory_map(str(source_path)) as source:
+        reader = pa.ipc.open_file(source)
+        targets = itertools.chain.from_iterable(
+            iter_batch_targets(reader.get_batch(batch_index)) for batch_index in range(reader.num_record_batches)
+        )
+        yield from itertools.islice(targets, num_series or None)
+
+
+def benchmark_sequential(path: Path):
+    """Reads the whole file through the same gluonts FileDataset train.py uses."""
+    num_series, num_values = 0, 0
+    start = time.perf_counter()
+    for entry in FileDataset(path=path, freq="h"):
+        num_series += 1
+        num_values += len(entry["target"])
+    return time.perf_counter() - start, num_series, num_values
+
+
+def benchmark_random(path: Path, num_reads: int, seed: int):
+    """
+    Reads `num_reads` uniformly drawn series, every read decodes the record batch holding the series.
+    Decoding goes through the same ArrowDecoder and ProcessDataEntry as FileDataset.
+    """
+    num_values = 0
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        decoder = ArrowDecoder.from_schema(reader.schema)
+        process = ProcessDataEntry("h", one_dim_target=True)
+        batch_ends = np.cumsum([reader.get_batch(i).num_rows for i in range(reader.num_record_batches)])
+        indices = np.random.default_rng(seed).integers(batch_ends[-1], size=num_reads)
+
+        start = time.perf_counter()
+        for idx in indices:
+            batch_index = int(np.searchsorted(batch_ends, idx, side="right"))
+            row_index = int(idx - (batch_ends[batch_index - 1] if batch_index > 0 else 0))
+            batch = reader.get_batch(batch_index).slice(row_index, 1)
+            num_values += len(process(next(decoder.decode_batch(batch)))["target"])
+        duration = time.perf_counter() - start
+
+    return duration, num_reads, num_values
+
+
+@app.command()
+def main(
+    source_path: str = "your/path/to/training_mix.arrow",
+    output_dir: str = "your/path/to/layout_benchmark",
+    # Number of series copied from the source file into every layout, 0 = all
+    num_series: int = 100_000,
+    codecs: List[str] = typer.Option(["uncompressed", "lz4", "zstd"]),
+    batch_sizes: List[int] = typer.Option([1_000, 10_000, 100_000]),
+    num_random_reads: int = 1_000,
+    seed: int = 0,
+    results_path: str = "arrow_layouts.csv",
+):
+    """
+    Writes the same corpus in every codec/record-batch-size layout and measures sequential and
+    random read throughput. Note that files are usually in the page cache after being written,
+    so run on the target storage with a corpus larger than RAM to see cold-read numbers.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    for codec, batch_size in itertools.product(codecs, batch_sizes):
+        path = output_dir / f"layout_{codec}_{batch_size}.arrow"
+        print(f"Writing {path}")
+        start = time.perf_counter()
+        convert_to_arrow_streaming(
+            path,
+            iter_source_targets(Path(source_path), num_series),
+            chunk_size=batch_size,
+            compression=None if codec == "uncompressed" else codec,
+        )
+        write_time = time.perf_counter() - start
+        file_mb = path.stat().st_size / 1e6
+
+        for access, (duration, series_read, values_read) in [
+            ("sequential", benchmark_sequential(path)),
+            ("random", benchmark_random(path, num_random_reads, seed)),
+        ]:
+            results.append(
+                {
+                    "codec": codec,
+                    "batch_size": batch_size,
+                    "file_mb": round(file_mb, 2),
+                    "write_s": round(write_time, 2),
+                    "access": access,
+                    "series_per_s": series_read / duration,
+                    # Throughput of decoded float32 values
+                    "decoded_mb_per_s": values_read * 4 / 1e6 / duration,
+                    # Share of the file read per second, only meaningful for sequential access
+                    "file_mb_per_s": file_mb / duration if access == "sequential" else np.nan,
+                }
+            )
+
+    results = pd.DataFrame(results)
+    results.to_csv(results_path, index=False)
+    print(results.to_string(index=False, float_format=lambda x: f"{x:.1f}"))
+    print(f"Results saved to '{results_path}'")
+
+
+if __name__ == "__main__":
+    app()
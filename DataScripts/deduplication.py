@@ -0,0 +1,84 @@
+import hashlib
+import math
+from typing import Dict, Iterable, Iterator
+import numpy as np
+
+
+def content_hash(target: np.ndarray) -> int:
+    """
+    64-bit hash of the float32 values of a target, identical for -0.0/0.0 and for all NaN payloads.
+
+    Always blake2b: the hashes are stored in the statistics sidecar and select the data_fraction
+    subsets of train.py, so they must not depend on the installed packages.
+    """
+    target = np.asarray(target, dtype=np.float32) + np.float32(0.0)
+    target = np.where(np.isnan(target), np.float32(np.nan), target)
+    return int.from_bytes(hashlib.blake2b(target.tobytes(), digest_size=8).digest(), "little")
+
+
+class Deduplicator:
+    """
+    Drops repeated targets from a stream of time series.
+
+    Seen targets are remembered by their content hash in a Bloom filter, so memory is
+    fixed by `capacity` and `error_rate` (about 36 MB for 10M series at 1e-6) instead
+    of growing with the corpus. A false positive drops a unique series, which happens
+    with probability `error_rate` as long as fewer than `capacity` series are kept.
+    """
+
+    def __init__(self, capacity: int = 10_000_000, error_rate: float = 1e-6):
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.num_bits / 8))
+
+        self.num_seen = 0
+        self.num_duplicates = 0
+        self.bytes_saved = 0
+
+    def _positions(self, h: int) -> Iterator[int]:
+        # Double hashing: the k bit positions are derived from the two halves of one 64-bit hash
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, target: np.ndarray) -> bool:
+        """Inserts the target, returns False if it (probably) was inserted before."""
+        is_new = False
+        for position in self._positions(content_hash(target)):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] >> bit & 1:
+                self.bits[byte] |= 1 << bit
+                is_new = True
+        return is_new
+
+    def filter(self, time_series: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        """Lazily yields the first occurrence of every target, one input series at a time."""
+        for target in time_series:
+            self.num_seen += 1
+            if self.add(target):
+                yield target
+            else:
+                self.num_duplicates += 1
+                self.bytes_saved += target.nbytes
+
+    def state_dict(self) -> Dict:
+        """Counters to store in a checkpoint, the filter itself is rebuilt from the kept series."""
+        return {
+            "num_seen": self.num_seen,
+            "num_duplicates": self.num_duplicates,
+            "bytes_saved": self.bytes_saved,
+        }
+
+    def load_state_dict(self, state: Dict):
+        self.num_seen = state["num_seen"]
+        self.num_duplicates = state["num_duplicates"]
+        self.bytes_saved = state["bytes_saved"]
+
+    def report(self) -> Dict:
+        return {
+            **self.state_dict(),
+            "num_kept": self.num_seen - self.num_duplicates,
+            "duplicate_rate": self.num_duplicates / self.num_seen if self.num_seen else 0.0,
+            "bloom_filter_bytes": len(self.bits),
+            "bloom_filter_hashes": self.num_hashes,
+        }
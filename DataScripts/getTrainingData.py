@@ -1,22 +1,109 @@
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Union
+from typing import Dict, Iterable, List, Optional, Union
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import datasets
+import typer
 from gluonts.dataset.arrow import ArrowWriter
+from gluonts.itertools import batcher
 from tqdm import tqdm  # Import tqdm for progress bar
+from deduplication import Deduplicator, content_hash
 
-print("Start Converting Data")
+app = typer.Typer(pretty_exceptions_enable=False)
 
-# Step 1: Load the dataset from Hugging Face -> Once for Augmented (training_corpus_tsmixup_10m) and once for Kernel Synth Data (training_corpus_kernel_synth_1m)
-ds = datasets.load_dataset("autogluon/chronos_datasets", "training_corpus_tsmixup_10m", streaming=True, split="train")
+# Every converted series gets the same dummy start, the training pipeline only uses the target
+START = np.datetime64("2000-01-01 00:00", "s")
 
+# Schema of the converted files, targets are stored as float32 since train.py casts them to float32 anyway
+ARROW_SCHEMA = pa.schema(
+    [
+        ("start", pa.timestamp("s")),
+        ("target", pa.list_(pa.float32())),
+    ]
+)
 
+# Schema of the per-series statistics sidecar (<stem>.stats.arrow), one row per series of the data file.
+# train.py uses it to skip series that are too short or have too many missing values without decoding them.
+STATS_SCHEMA = pa.schema(
+    [
+        ("length", pa.int32()),
+        ("nan_fraction", pa.float64()),
+        ("mean_abs", pa.float32()),
+        ("batch_index", pa.int32()),  # record batch of the data file that holds the series
+        ("row_index", pa.int32()),  # row of the series within that record batch
+        ("byte_offset", pa.int64()),  # file offset of that record batch, -1 if unknown
+        ("content_hash", pa.uint64()),  # 64-bit hash of the target, selects the data_fraction subset in train.py
+    ]
+)
 
-# Step 2: Extract time-series data with progress bar
-# Using tqdm to display the progress as we loop through the dataset
-time_series = [np.array(data['target']) for data in tqdm(ds, desc="Processing time series")]
 
-# Step 3: Define the convert_to_arrow function
+def get_stats_path(path: Path) -> Path:
+    """E.g. training_mix.arrow -> training_mix.stats.arrow"""
+    return path.with_suffix(".stats.arrow")
+
+
+@contextmanager
+def open_arrow_writer(path: Path, schema: pa.Schema, compression: str = None):
+    """Opens an Arrow (random access) file writer, yields the sink as well so callers can look up byte offsets."""
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+        yield sink, writer
+
+
+def get_batch_offset(sink: pa.OSFile, schema: pa.Schema) -> int:
+    """File offset at which the next record batch will be written."""
+    offset = sink.tell()
+    # The writer only writes the file magic and the schema together with the first batch
+    return offset if offset > 0 else len(b"ARROW1\0\0") + schema.serialize().size
+
+
+def compute_stats(batch: pa.RecordBatch, batch_index: int, byte_offset: int = -1) -> pa.RecordBatch:
+    """Computes length, NaN fraction, mean absolute value and content hash of every series in the batch."""
+    target = batch.column("target")
+    lengths = pc.list_value_length(target).to_numpy(zero_copy_only=False).astype(np.int64)
+    values = target.flatten().to_numpy(zero_copy_only=False)
+
+    # Per-series sums via cumulative sums over the flat values, empty series get zero sums
+    bounds = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=bounds[1:])
+    is_nan = np.isnan(values)
+    nan_counts = np.diff(np.concatenate([[0], np.cumsum(is_nan)])[bounds])
+    abs_sums = np.diff(np.concatenate([[0.0], np.cumsum(np.where(is_nan, 0.0, np.abs(values)), dtype=np.float64)])[bounds])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        nan_fraction = np.where(lengths > 0, nan_counts / lengths, 1.0)
+        mean_abs = np.where(lengths > nan_counts, abs_sums / (lengths - nan_counts), 0.0)
+    hashes = np.array([content_hash(values[bounds[i]:bounds[i + 1]]) for i in range(len(lengths))], dtype=np.uint64)
+
+    return pa.RecordBatch.from_arrays(
+        [
+            pa.array(lengths.astype(np.int32)),
+            pa.array(nan_fraction, type=pa.float64()),
+            pa.array(mean_abs.astype(np.float32)),
+            pa.array(np.full(len(lengths), batch_index, dtype=np.int32)),
+            pa.array(np.arange(len(lengths), dtype=np.int32)),
+            pa.array(np.full(len(lengths), byte_offset, dtype=np.int64)),
+            pa.array(hashes, type=pa.uint64()),
+        ],
+        schema=STATS_SCHEMA,
+    )
+
+
+# Builds the sidecar for an already converted file (e.g. from the in-memory conversion), record batch offsets are unknown here
+def write_stats(path: Path):
+    with pa.memory_map(str(path)) as source, open_arrow_writer(get_stats_path(path), STATS_SCHEMA) as (_, stats_writer):
+        reader = pa.ipc.open_file(source)
+        for batch_index in tqdm(range(reader.num_record_batches), desc="Computing statistics"):
+            stats_writer.write_batch(compute_stats(reader.get_batch(batch_index), batch_index))
+
+
+# In-memory conversion, needs the whole corpus (twice) in RAM
 def convert_to_arrow(
     path: Union[str, Path],
     time_series: Union[List[np.ndarray], np.ndarray],
@@ -26,12 +113,408 @@ def convert_to_arrow(
         isinstance(time_series, np.ndarray) and
         time_series.ndim == 2
     )
-    start = np.datetime64("2000-01-01 00:00", "s")
-    dataset = [{"start": start, "target": ts} for ts in tqdm(time_series, desc="Converting to Arrow")]
+    dataset = [{"start": START, "target": ts} for ts in tqdm(time_series, desc="Converting to Arrow")]
     ArrowWriter(compression=compression).write_to_file(dataset, path=path)
+    write_stats(Path(path))
+
+
+def to_record_batch(targets: List[np.ndarray]) -> pa.RecordBatch:
+    """Builds one Arrow record batch from a list of float32 targets without going through python objects."""
+    lengths = np.fromiter((len(ts) for ts in targets), dtype=np.int32, count=len(targets))
+    offsets = np.zeros(len(targets) + 1, dtype=np.int32)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.concatenate(targets) if targets else np.empty(0, dtype=np.float32)
+
+    target_array = pa.ListArray.from_arrays(pa.array(offsets), pa.array(values, type=pa.float32()))
+    start_array = pa.array(np.full(len(targets), START), type=pa.timestamp("s"))
+    return pa.RecordBatch.from_arrays([start_array, target_array], schema=ARROW_SCHEMA)
+
+
+# Streaming conversion, only ever holds one chunk of series in memory
+def convert_to_arrow_streaming(
+    path: Union[str, Path],
+    time_series: Iterable[np.ndarray],
+    chunk_size: int = 10_000,
+    compression: str = "lz4",
+) -> int:
+    """Writes the time series as Arrow record batches of `chunk_size` series each and returns the number of series written."""
+    path = Path(path)
+    num_series = 0
+
+    with open_arrow_writer(path, ARROW_SCHEMA, compression) as (sink, writer), \
+            open_arrow_writer(get_stats_path(path), STATS_SCHEMA) as (_, stats_writer):
+        for batch_index, chunk in enumerate(batcher(time_series, chunk_size)):
+            batch = to_record_batch(chunk)
+            stats_writer.write_batch(compute_stats(batch, batch_index, get_batch_offset(sink, ARROW_SCHEMA)))
+            writer.write_batch(batch)
+            num_series += len(chunk)
+
+    return num_series
+
+
+def iter_targets(ds) -> Iterable[np.ndarray]:
+    """Yields the targets of a (streamed) Hugging Face dataset as float32 arrays."""
+    for data in ds:
+        yield np.asarray(data["target"], dtype=np.float32)
+
+
+def iter_batch_targets(batch: pa.RecordBatch) -> Iterable[np.ndarray]:
+    """Yields the targets of a converted record batch as float32 arrays."""
+    target = batch.column("target")
+    bounds = np.zeros(len(target) + 1, dtype=np.int64)
+    np.cumsum(pc.list_value_length(target).to_numpy(zero_copy_only=False), out=bounds[1:])
+    values = target.flatten().to_numpy(zero_copy_only=False)
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        yield values[start:end]
+
+
+def get_dedup_report_path(path: Path) -> Path:
+    """E.g. training_mix.arrow -> training_mix.dedup.json"""
+    return path.with_suffix(".dedup.json")
+
+
+def write_dedup_report(path: Path, deduplicator: Deduplicator) -> Dict:
+    report = deduplicator.report()
+    with open(get_dedup_report_path(path), "w") as fp:
+        json.dump(report, fp, indent=4)
+    print(f"Dropped {report['num_duplicates']} of {report['num_seen']} series as duplicates "
+          f"({report['duplicate_rate']:.2%}, {report['bytes_saved'] / 1e6:.1f} MB saved)")
+    return report
+
+
+def get_progress_path(path: Path) -> Path:
+    """E.g. training_mix.arrow -> training_mix.arrow.progress.json"""
+    return path.with_name(path.name + ".progress.json")
+
+
+def get_parts_dir(path: Path) -> Path:
+    """E.g. training_mix.arrow -> training_mix.arrow.parts/"""
+    return path.with_name(path.name + ".parts")
+
+
+def load_progress(path: Path) -> Dict:
+    progress_path = get_progress_path(path)
+    if not progress_path.exists():
+        return {"num_series": 0, "num_chunks": 0, "stream_state": None, "complete": False}
+    with open(progress_path) as fp:
+        return json.load(fp)
+
+
+def save_progress(path: Path, progress: Dict):
+    # Write to a temporary file first so that a kill during the write never leaves a broken progress file
+    progress_path = get_progress_path(path)
+    tmp_path = progress_path.with_name(progress_path.name + ".tmp")
+    with open(tmp_path, "w") as fp:
+        json.dump(progress, fp, indent=4)
+    os.replace(tmp_path, progress_path)
+
+
+def reset_progress(path: Path):
+    """Removes the progress file and committed chunks of a previous conversion into `path`."""
+    get_progress_path(path).unlink(missing_ok=True)
+    shutil.rmtree(get_parts_dir(path), ignore_errors=True)
+
+
+def assemble_parts(path: Path, num_chunks: int, compression: str):
+    """Writes the committed chunks (in order) into the final Arrow file, the chunks are only compressed here."""
+    parts_dir = get_parts_dir(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_stats_path = get_stats_path(path).with_name(get_stats_path(path).name + ".tmp")
+
+    with open_arrow_writer(tmp_path, ARROW_SCHEMA, compression) as (sink, writer), \
+            open_arrow_writer(tmp_stats_path, STATS_SCHEMA) as (_, stats_writer):
+        for chunk_index in range(num_chunks):
+            with pa.memory_map(str(parts_dir / f"chunk-{chunk_index:06d}.arrow")) as source:
+                for batch in pa.ipc.open_stream(source):
+                    stats_writer.write_batch(compute_stats(batch, chunk_index, get_batch_offset(sink, ARROW_SCHEMA)))
+                    writer.write_batch(batch)
+
+    os.replace(tmp_stats_path, get_stats_path(path))
+    os.replace(tmp_path, path)
+
+
+# Streaming conversion that commits every chunk to disk and can continue after being killed (e.g. SLURM timeout or OOM)
+def convert_to_arrow_resumable(
+    path: Union[str, Path],
+    ds,
+    chunk_size: int = 10_000,
+    compression: str = "lz4",
+    desc: str = "Converting to Arrow",
+    position: int = 0,
+    deduplicator: Optional[Deduplicator] = None,
+) -> int:
+    """
+    Converts the streamed Hugging Face dataset `ds` into the Arrow file `path`.
+
+    After each chunk of `chunk_size` series the chunk is written to `<path>.parts/` and the
+    position in the input stream (`ds.state_dict()`) is recorded in `<path>.progress.json`.
+    On restart the stream continues from the last committed chunk. Since the chunk boundaries
+    do not depend on where a run was interrupted, the final file is byte-identical to the one
+    of an uninterrupted run. Returns the number of series in the final file.
+
+    With a `deduplicator`, repeated targets are dropped. Its counters are checkpointed together
+    with the stream position and its filter is rebuilt from the committed chunks on restart.
+    """
+    path = Path(path)
+    progress = load_progress(path)
+    if progress["complete"]:
+        if path.exists():
+            print(f"'{path}' was already converted, skipping")
+            return progress["num_series"]
+        # The chunks were removed after assembling the deleted file, so it is converted again
+        print(f"'{path}' was converted but no longer exists, converting it again")
+        reset_progress(path)
+        progress = load_progress(path)
+
+    parts_dir = get_parts_dir(path)
+    parts_dir.mkdir(parents=True, exist_ok=True)
+
+    if progress["stream_state"] is not None:
+        print(f"Resuming conversion of '{path}' after {progress['num_series']} series")
+        ds.load_state_dict(progress["stream_state"])
+
+        if deduplicator is not None:
+            deduplicator.load_state_dict(progress["dedup"])
+            for chunk_index in range(progress["num_chunks"]):
+                with pa.memory_map(str(parts_dir / f"chunk-{chunk_index:06d}.arrow")) as source:
+                    for batch in pa.ipc.open_stream(source):
+                        for target in iter_batch_targets(batch):
+                            deduplicator.add(target)
+
+    time_series = iter_targets(ds)
+    if deduplicator is not None:
+        time_series = deduplicator.filter(time_series)
+    time_series = tqdm(time_series, desc=desc, position=position, initial=progress["num_series"])
+
+    for chunk in batcher(time_series, chunk_size):
+        # Chunks are stored uncompressed, compression happens once when the parts are assembled
+        chunk_path = parts_dir / f"chunk-{progress['num_chunks']:06d}.arrow"
+        tmp_path = chunk_path.with_name(chunk_path.name + ".tmp")
+        with pa.OSFile(str(tmp_path), "wb") as sink, pa.ipc.new_stream(sink, ARROW_SCHEMA) as writer:
+            writer.write_batch(to_record_batch(chunk))
+        os.replace(tmp_path, chunk_path)
+
+        # The chunk is only committed once the progress file points past it
+        progress["num_series"] += len(chunk)
+        progress["num_chunks"] += 1
+        progress["stream_state"] = ds.state_dict()
+        if deduplicator is not None:
+            progress["dedup"] = deduplicator.state_dict()
+        save_progress(path, progress)
+
+    assemble_parts(path, progress["num_chunks"], compression)
+    if deduplicator is not None:
+        write_dedup_report(path, deduplicator)
+    progress["complete"] = True
+    save_progress(path, progress)
+    shutil.rmtree(parts_dir)
+
+    return progress["num_series"]
+
+
+def load_corpus(dataset_name: str, num_shards: int = 1, shard_index: int = 0):
+    """Streams the given corpus from Hugging Face, optionally only one of `num_shards` disjoint shards of it."""
+    ds = datasets.load_dataset("autogluon/chronos_datasets", dataset_name, streaming=True, split="train")
+    ds = ds.select_columns(["target"])
+    if num_shards > 1:
+        ds = ds.shard(num_shards=num_shards, index=shard_index)
+    return ds
+
+
+def get_shard_path(output_path: Path, shard_index: int, num_shards: int) -> Path:
+    """E.g. training_mix.arrow -> training_mix-00003-of-00008.arrow"""
+    return output_path.with_name(f"{output_path.stem}-{shard_index:05d}-of-{num_shards:05d}{output_path.suffix}")
+
+
+def get_manifest_path(output_path: Path) -> Path:
+    """E.g. training_mix.arrow -> training_mix.json"""
+    return output_path.with_suffix(".json")
+
+
+def convert_shard(
+    dataset_name: str,
+    output_path: Path,
+    shard_index: int,
+    num_shards: int,
+    chunk_size: int,
+    compression: str,
+    resume: bool = True,
+    dedup_capacity: int = 0,
+) -> Dict:
+    """Converts one shard of the corpus (runs in a worker process) and returns its manifest entry."""
+    shard_path = get_shard_path(output_path, shard_index, num_shards)
+    ds = load_corpus(dataset_name, num_shards=num_shards, shard_index=shard_index)
+    # Duplicates are only detected within a shard
+    deduplicator = Deduplicator(capacity=dedup_capacity) if dedup_capacity > 0 else None
+    if resume:
+        num_series = convert_to_arrow_resumable(
+            shard_path,
+            ds,
+            chunk_size=chunk_size,
+            compression=compression,
+            desc=f"Shard {shard_index}",
+            position=shard_index,
+            deduplicator=deduplicator,
+        )
+    else:
+        reset_progress(shard_path)
+        time_series = iter_targets(ds)
+        if deduplicator is not None:
+            time_series = deduplicator.filter(time_series)
+        num_series = convert_to_arrow_streaming(
+            shard_path,
+            tqdm(time_series, desc=f"Shard {shard_index}", position=shard_index),
+            chunk_size=chunk_size,
+            compression=compression,
+        )
+        if deduplicator is not None:
+            write_dedup_report(shard_path, deduplicator)
+    shard = {
+        "path": shard_path.name,  # relative to the manifest
+        "stats_path": get_stats_path(shard_path).name,
+        "num_series": num_series,
+        "num_bytes": shard_path.stat().st_size,
+    }
+    if deduplicator is not None:
+        with open(get_dedup_report_path(shard_path)) as fp:
+            report = json.load(fp)
+        shard["num_duplicates"] = report["num_duplicates"]
+        shard["bytes_saved"] = report["bytes_saved"]
+    return shard
+
+
+def write_manifest(manifest_path: Path, dataset_name: str, shards: List[Dict]):
+    """Writes the shard manifest that train.py accepts in place of a single Arrow file."""
+    manifest = {
+        "dataset_name": dataset_name,
+        "num_series": sum(shard["num_series"] for shard in shards),
+        "num_bytes": sum(shard["num_bytes"] for shard in shards),
+        "shards": shards,
+    }
+    with open(manifest_path, "w") as fp:
+        json.dump(manifest, fp, indent=4)
+
+
+# Parallel conversion, each worker process streams and writes its own disjoint shard of the corpus
+def convert_sharded(
+    dataset_name: str,
+    output_path: Path,
+    num_shards: int,
+    num_workers: int,
+    chunk_size: int = 10_000,
+    compression: str = "lz4",
+    resume: bool = True,
+    dedup_capacity: int = 0,
+) -> List[Dict]:
+    n_source_shards = load_corpus(dataset_name).num_shards
+    if num_shards > n_source_shards:
+        print(f"Corpus only has {n_source_shards} source files, using {n_source_shards} shards instead of {num_shards}")
+        num_shards = n_source_shards
+
+    with ProcessPoolExecutor(max_workers=min(num_workers, num_shards)) as executor:
+        shards = list(
+            executor.map(
+                convert_shard,
+                [dataset_name] * num_shards,
+                [output_path] * num_shards,
+                range(num_shards),
+                [num_shards] * num_shards,
+                [chunk_size] * num_shards,
+                [compression] * num_shards,
+                [resume] * num_shards,
+                [dedup_capacity // num_shards] * num_shards,
+            )
+        )
+
+    write_manifest(get_manifest_path(output_path), dataset_name, shards)
+    return shards
+
+
+@app.command()
+def main(
+    # Once for Augmented (training_corpus_tsmixup_10m) and once for Kernel Synth Data (training_corpus_kernel_synth_1m)
+    dataset_name: str = "training_corpus_tsmixup_10m",
+    output_path: str = "your/path/to/training_mix.arrow",
+    streaming: bool = True,
+    chunk_size: int = 10_000,
+    # lz4, zstd or uncompressed, which train.py --random-access reads without decompressing
+    compression: str = "lz4",
+    # With num_shards > 1 the corpus is written as shards plus a manifest (<output_path stem>.json)
+    num_shards: int = 1,
+    num_workers: int = os.cpu_count() or 1,
+    # Checkpoint the conversion after every chunk and continue from there when restarted
+    resume: bool = True,
+    # Only write the per-series statistics sidecar for an already converted file
+    stats_only: bool = False,
+    # Drop repeated targets, the Bloom filter is sized for dedup_capacity unique series
+    dedup: bool = False,
+    dedup_capacity: int = 10_000_000,
+):
+    output_path = Path(output_path)
+    if compression == "uncompressed":
+        compression = None
+
+    if stats_only:
+        write_stats(output_path)
+        print(f"Statistics stored in '{get_stats_path(output_path)}'")
+        return
+
+    print("Start Converting Data")
+
+    if num_shards > 1:
+        shards = convert_sharded(
+            dataset_name,
+            output_path,
+            num_shards=num_shards,
+            num_workers=num_workers,
+            chunk_size=chunk_size,
+            compression=compression,
+            resume=resume,
+            dedup_capacity=dedup_capacity if dedup else 0,
+        )
+        num_series = sum(shard["num_series"] for shard in shards)
+        if dedup:
+            num_duplicates = sum(shard["num_duplicates"] for shard in shards)
+            bytes_saved = sum(shard["bytes_saved"] for shard in shards)
+            print(f"Dropped {num_duplicates} of {num_series + num_duplicates} series as duplicates "
+                  f"({num_duplicates / max(1, num_series + num_duplicates):.2%}, {bytes_saved / 1e6:.1f} MB saved)")
+        print(f"Dataset with {num_series} series successfully converted into {len(shards)} shards, manifest stored in '{get_manifest_path(output_path)}'")
+        return
+
+    # Step 1: Load the dataset from Hugging Face
+    ds = load_corpus(dataset_name)
+
+    deduplicator = Deduplicator(capacity=dedup_capacity) if dedup else None
+
+    # Step 2: Extract the time-series data and convert it to Arrow format
+    if streaming and resume:
+        num_series = convert_to_arrow_resumable(
+            output_path, ds, chunk_size=chunk_size, compression=compression, deduplicator=deduplicator
+        )
+    else:
+        time_series = iter_targets(ds)
+        if deduplicator is not None:
+            time_series = deduplicator.filter(time_series)
+
+        if streaming:
+            # Peak memory is bounded by chunk_size, not by the size of the corpus
+            reset_progress(output_path)
+            num_series = convert_to_arrow_streaming(
+                output_path,
+                tqdm(time_series, desc="Converting to Arrow"),
+                chunk_size=chunk_size,
+                compression=compression,
+            )
+        else:
+            time_series = list(tqdm(time_series, desc="Processing time series"))
+            num_series = len(time_series)
+            convert_to_arrow(output_path, time_series=time_series, compression=compression)
+
+        if deduplicator is not None:
+            write_dedup_report(output_path, deduplicator)
 
-# Step 4: Convert the time-series data to Arrow format
-convert_to_arrow("your/path/to/training_mix.arrow", time_series=time_series)
+    print(f"Dataset with {num_series} series successfully converted and stored in '{output_path}'")
 
-print("Dataset successfully converted and stored in 'training_mix.arrow'")
 
+if __name__ == "__main__":
+    app()
@@ -14,8 +14,11 @@ fixed_config = {
     "prediction_length": 64,
     "min_past": 60,
     "max_steps": 200000,
-    "save_steps": 10000,
+    "save_steps": 50000,  # full checkpoints to resume from
+    "snapshot_steps": 10000,  # weights-only checkpoints for evaluation
     "log_steps": 500,
+    "validation_data_paths": ["your/path/to/validation.arrow"],  # held-out series, eval_loss in LearningCurves
+    "validation_steps": 10000,
     "optim": "adamw_torch_fused",
     "num_samples": 20,
     "shuffle_buffer_length": 100000,
@@ -34,7 +37,7 @@ fixed_config = {
     "d_model": 512,
     "num_layers": 6,
     "num_heads": 8,
-    "d_ff": 2048
+    "d_ff": 2048,
 }
 
 # Scaling methods with multiple values
@@ -43,6 +46,7 @@ scaling_values = {
     "context_length": [256],
     "num_heads": [1],
     "num_layers": [2],
+    "data_fraction": [0.1],
 }
 
 scaling_methods = list(scaling_values.keys())
@@ -11,6 +11,7 @@ SCALING_PARAMS = {
     "context_length": range(51, 101),
     "num_heads": range(101, 151),
     "num_layers": range(151, 201),
+    "data_fraction": range(201, 251),
     "max_steps": range(1, 51),  # Use the default model IDs 1-50
     "steps_10000": range(1, 51),
     "steps_30000": range(1, 51),
@@ -99,6 +100,14 @@ def get_model_version_id(config_id, training_step):
 
     if version:
         return version[0]
+
+    # Runs ended early by the stopping rule of train.py have no later model versions
+    early_stop = execute_with_retries(
+        "SELECT training_step, reason FROM EarlyStops WHERE run_id = ?", (run_id,), fetchone=True
+    )
+    if early_stop:
+        print(f"Skipping run_id {run_id}: stopped early at step {early_stop[0]} ({early_stop[1]}).")
+        sys.exit(0)
     else:
         print(f"Error: No ModelVersion found for run_id {run_id} and training_step {training_step}.")
         sys.exit(1)
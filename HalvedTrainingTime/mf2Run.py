@@ -35,13 +35,25 @@ def train_model(scaling_method, config_id, config_json):
     start_time = datetime.datetime.now()
     print(f"Training started for config ID: {config_id} at {start_time}")
 
-    # Insert new run entry in TrainingRuns table
+    # An unfinished run of this config, e.g. killed at the SLURM time limit, is
+    # resumed by train.py from its last checkpoint and keeps its TrainingRuns row
     cursor.execute(
-        "INSERT INTO TrainingRuns (config_id, start_time) VALUES (?, ?)",
-        (config_id, start_time),
+        "SELECT run_id FROM TrainingRuns WHERE config_id = ? AND end_time IS NULL ORDER BY run_id DESC LIMIT 1",
+        (config_id,),
     )
-    run_id = cursor.lastrowid  # Get the newly created run ID
-    connection.commit()
+    unfinished_run = cursor.fetchone()
+
+    if unfinished_run:
+        run_id = unfinished_run[0]
+        print(f"Resuming run ID: {run_id} for config ID: {config_id}")
+    else:
+        # Insert new run entry in TrainingRuns table
+        cursor.execute(
+            "INSERT INTO TrainingRuns (config_id, start_time) VALUES (?, ?)",
+            (config_id, start_time),
+        )
+        run_id = cursor.lastrowid  # Get the newly created run ID
+        connection.commit()
 
     # Convert config JSON to dictionary
     config = eval(config_json)  
@@ -54,7 +66,11 @@ def train_model(scaling_method, config_id, config_json):
 
         # Run training
         result = subprocess.run(
-            ["python3", TRAIN_SCRIPT, "--config", yaml_path],
+            [
+                "python3", TRAIN_SCRIPT, "--config", yaml_path,
+                # Record the step times and learning curve of this run
+                "--run-db", os.path.abspath(DB_PATH), "--run-id", str(run_id),
+            ],
             capture_output=True,
             text=True
         )
@@ -65,6 +81,12 @@ def train_model(scaling_method, config_id, config_json):
             connection.close()
             return
 
+        # A run ended early by the stopping rule has no checkpoints after that step
+        cursor.execute("SELECT training_step, reason FROM EarlyStops WHERE run_id = ?", (run_id,))
+        early_stop = cursor.fetchone()
+        if early_stop:
+            print(f"Training for config ID: {config_id} stopped early at step {early_stop[0]}: {early_stop[1]}")
+
         # Define model checkpoint paths: Checks for available chekpoints each 10000 steps, skips if no such checkpoint available e.g. no generateed intermedaite results
         trained_model_paths = {
             step: f"./output/{scaling_method}/{config_id}/run-0/checkpoint-{step}" if step != 200000 else f"./output/{scaling_method}/{config_id}/run-0/checkpoint-final"
@@ -73,6 +95,8 @@ def train_model(scaling_method, config_id, config_json):
 
         # Insert model versions into DB
         for step, model_checkpoint_path in trained_model_paths.items():
+            if early_stop and step > early_stop[0]:
+                continue
             if os.path.exists(model_checkpoint_path):
                 cursor.execute(
                     """
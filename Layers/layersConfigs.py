@@ -43,6 +43,12 @@ scaling_values = {
     "num_layers_6": [6]
 }
 
+# Steps to train the num_layers_4 and num_layers_6 configs for when they are grown
+# from the trained config with 2 fewer layers (same sampled hyperparameters),
+# or None to train every config from scratch for max_steps
+warm_start_max_steps = None
+warm_start_parents = {"num_layers_4": "num_layers_2", "num_layers_6": "num_layers_4"}
+
 # Define the configuration space for tunable parameters
 cs = ConfigurationSpace()
 cs.add_hyperparameter(CategoricalHyperparameter("n_tokens", [2048, 4096, 8192]))
@@ -68,10 +74,12 @@ for method in scaling_values.keys():
     scaling_method_ids[method] = cursor.lastrowid
 
 # Generate configurations for each scaling method (num_layers_2, num_layers_4, num_layers_6)
+config_ids = {}
 for method, values in scaling_values.items():
     scaling_method_id = scaling_method_ids[method]
+    config_ids[method] = []
     
-    for config in configs:
+    for config_index, config in enumerate(configs):
         # Start with the sampled config and update it with the fixed parameters
         base_config = dict(config)
         base_config.update(fixed_config)
@@ -79,14 +87,22 @@ for method, values in scaling_values.items():
         # Apply the current scaling value (e.g., num_layers=2, num_layers=4, or num_layers=6)
         config_variant = base_config.copy()  # Create a copy for this variant
         config_variant["num_layers"] = values[0]  # Override "num_layers" with the scaling value
+
+        # Grow the model from the same sampled config with fewer layers; layersRun.py
+        # passes the final checkpoint of that config's run to train.py
+        warm_start_config_id = None
+        if warm_start_max_steps is not None and method in warm_start_parents:
+            warm_start_config_id = config_ids[warm_start_parents[method]][config_index]
+            config_variant["warm_start_max_steps"] = warm_start_max_steps
         
         # Convert config to JSON string (using double quotes)
         config_json = str(config_variant).replace("'", '"')
         cursor.execute("""
-        INSERT INTO Configs (scaling_method_id, config_json)
-        VALUES (?, ?)
-        """, (scaling_method_id, config_json))
+        INSERT INTO Configs (scaling_method_id, config_json, warm_start_config_id)
+        VALUES (?, ?, ?)
+        """, (scaling_method_id, config_json, warm_start_config_id))
         config_id = cursor.lastrowid  # Get the unique config_id
+        config_ids[method].append(config_id)
         
         # Update output_dir in the configuration to include the config_id and scaling method
         config_variant["output_dir"] = f"./output/{method}/{config_id}/"
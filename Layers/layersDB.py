@@ -18,10 +18,17 @@ CREATE TABLE IF NOT EXISTS Configs (
     config_id INTEGER PRIMARY KEY AUTOINCREMENT,
     scaling_method_id INTEGER NOT NULL,
     config_json TEXT NOT NULL,
-    FOREIGN KEY (scaling_method_id) REFERENCES ScalingMethods(scaling_method_id)
+    warm_start_config_id INTEGER, -- smaller config this config is grown from, see layersConfigs.py
+    FOREIGN KEY (scaling_method_id) REFERENCES ScalingMethods(scaling_method_id),
+    FOREIGN KEY (warm_start_config_id) REFERENCES Configs(config_id)
 );
 """)
 
+# Add columns to Configs tables created before them
+columns = [row[1] for row in cursor.execute("PRAGMA table_info(Configs)")]
+if "warm_start_config_id" not in columns:
+    cursor.execute("ALTER TABLE Configs ADD COLUMN warm_start_config_id INTEGER")
+
 # Create the TrainingRuns table
 cursor.execute("""
 CREATE TABLE IF NOT EXISTS TrainingRuns (
@@ -33,6 +40,17 @@ CREATE TABLE IF NOT EXISTS TrainingRuns (
 );
 """)
 
+# Create the WarmStarts table: the trained model a warm-started run was grown from
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS WarmStarts (
+    run_id INTEGER PRIMARY KEY,
+    parent_run_id INTEGER NOT NULL,
+    parent_model_path TEXT NOT NULL,
+    FOREIGN KEY (run_id) REFERENCES TrainingRuns(run_id),
+    FOREIGN KEY (parent_run_id) REFERENCES TrainingRuns(run_id)
+);
+""")
+
 # Create the ModelVersions table
 cursor.execute("""
 CREATE TABLE IF NOT EXISTS ModelVersions (
@@ -73,6 +73,21 @@ def get_model_version_id(config_id, training_step):
         print(f"Error: No ModelVersion found for run_id {run_id} and training_step {training_step}.")
         sys.exit(1)
 
+def get_final_training_step(config_id):
+    """Training step of the final model of a config, below 200000 for configs grown from a smaller one."""
+    connection = sqlite3.connect(DB_PATH)
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+        SELECT m.training_step FROM ModelVersions m JOIN TrainingRuns r ON m.run_id = r.run_id
+        WHERE r.config_id = ? AND m.model_path LIKE '%checkpoint-final'
+        """,
+        (config_id,)
+    )
+    final_version = cursor.fetchone()
+    connection.close()
+    return final_version[0] if final_version else 200000
+
 def parse_results(results_path):
     """Parse evaluation results and compute mean MASE, WQL, RMSE, and MAE."""
     try:
@@ -114,7 +129,7 @@ def evaluate_model(scaling_param, task_id):
     
     #creates model paths
     config_id = config_ids[task_id]
-    training_step = 200000
+    training_step = get_final_training_step(config_id)
     model_path = f"{BASE_PATH}/{scaling_param}/{config_id}/run-0/checkpoint-final"
     results_dir = f"{model_path}/results"
     os.makedirs(results_dir, exist_ok=True)
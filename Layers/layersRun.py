@@ -31,20 +31,65 @@ def train_model(scaling_method, config_id, config_json):
     connection = connect_with_retry(DB_PATH)
     cursor = connection.cursor()
 
+    # Convert config JSON to dictionary
+    config = eval(config_json)
+    max_steps = config["max_steps"]
+
+    # A config grown from a smaller one (see layersConfigs.py) starts from the final
+    # model of that config's finished run, which therefore has to be trained first
+    cursor.execute("SELECT warm_start_config_id FROM Configs WHERE config_id = ?", (config_id,))
+    warm_start_config_id = cursor.fetchone()[0]
+    parent = None
+    if warm_start_config_id is not None:
+        cursor.execute(
+            """
+            SELECT r.run_id, m.model_path FROM TrainingRuns r
+            JOIN ModelVersions m ON m.run_id = r.run_id
+            WHERE r.config_id = ? AND r.end_time IS NOT NULL AND m.model_path LIKE '%checkpoint-final'
+            ORDER BY r.run_id DESC LIMIT 1
+            """,
+            (warm_start_config_id,),
+        )
+        parent = cursor.fetchone()
+        if not parent:
+            print(f"Config ID: {config_id} is grown from config ID: {warm_start_config_id}, which has not finished training yet")
+            connection.close()
+            return
+        config["warm_start_from"] = parent[1]
+        max_steps = config["warm_start_max_steps"]
+        print(f"Growing config ID: {config_id} from {parent[1]} (run ID: {parent[0]})")
+
     # Record the start time
     start_time = datetime.datetime.now()
     print(f"Training started for config ID: {config_id} at {start_time}")
 
-    # Insert new run entry in TrainingRuns table
+    # An unfinished run of this config, e.g. killed at the SLURM time limit, is
+    # resumed by train.py from its last checkpoint and keeps its TrainingRuns row
     cursor.execute(
-        "INSERT INTO TrainingRuns (config_id, start_time) VALUES (?, ?)",
-        (config_id, start_time),
+        "SELECT run_id FROM TrainingRuns WHERE config_id = ? AND end_time IS NULL ORDER BY run_id DESC LIMIT 1",
+        (config_id,),
     )
-    run_id = cursor.lastrowid  # Get the newly created run ID
-    connection.commit()
-
-    # Convert config JSON to dictionary
-    config = eval(config_json)  
+    unfinished_run = cursor.fetchone()
+
+    if unfinished_run:
+        run_id = unfinished_run[0]
+        print(f"Resuming run ID: {run_id} for config ID: {config_id}")
+    else:
+        # Insert new run entry in TrainingRuns table
+        cursor.execute(
+            "INSERT INTO TrainingRuns (config_id, start_time) VALUES (?, ?)",
+            (config_id, start_time),
+        )
+        run_id = cursor.lastrowid  # Get the newly created run ID
+        connection.commit()
+
+    # Record the lineage of a warm-started run
+    if parent:
+        cursor.execute(
+            "INSERT OR REPLACE INTO WarmStarts (run_id, parent_run_id, parent_model_path) VALUES (?, ?, ?)",
+            (run_id, parent[0], parent[1]),
+        )
+        connection.commit()
 
     # Create a temporary YAML config file
     with tempfile.TemporaryDirectory() as temp_dir:
@@ -65,11 +110,15 @@ def train_model(scaling_method, config_id, config_json):
             connection.close()
             return
 
-        # Define model checkpoint paths: Checks for available chekpoints each 10000 steps, skips if no such checkpoint available e.g. no generateed intermedaite results
+        # Define model checkpoint paths: the checkpoints train.py writes every save_steps and
+        # snapshot_steps before max_steps (skipped if not available), and the final model
+        run_dir = f"./output/{scaling_method}/{config_id}/run-0"
+        intervals = [interval for interval in (config["save_steps"], config.get("snapshot_steps")) if interval]
         trained_model_paths = {
-            step: f"./output/{scaling_method}/{config_id}/run-0/checkpoint-{step}" if step != 200000 else f"./output/{scaling_method}/{config_id}/run-0/checkpoint-final"
-            for step in range(10000, 210000, 10000)
+            step: f"{run_dir}/checkpoint-{step}"
+            for step in sorted({step for interval in intervals for step in range(interval, max_steps, interval)})
         }
+        trained_model_paths[max_steps] = f"{run_dir}/checkpoint-final"
 
         # Insert model versions into DB
         for step, model_checkpoint_path in trained_model_paths.items():
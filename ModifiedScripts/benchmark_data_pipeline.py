@@ -0,0 +1,226 @@
+"""
+Throughput benchmark of the training data pipeline, to tell whether a
+(tiny) model is limited by the data path. The ``ChronosDataset`` is built by
+``create_train_dataset`` exactly as in ``train.py``, and samples/s are
+measured after every stage:
+
+- ``decode``: series read from the training files
+- ``filter``: series passing the ``min_past + prediction_length`` /
+  ``max_missing_prop`` filter
+- ``instance_splitter``: training windows sampled from the series
+- ``to_hf_format``: tokenized samples, mixed over the training files
+- ``shuffle_buffer``: samples out of the shuffle buffer
+- ``dataloader``: collated batches, for every number of DataLoader workers
+
+Every stage includes the stages before it, so the cost of a stage is the
+difference to the previous one. ``first_item_s`` is the time until the first
+item, e.g. the shuffle buffer warm-up, which is not included in samples/s.
+Without ``--data-paths`` a small synthetic Arrow file is generated, so the
+benchmark runs on any CPU-only machine.
+
+Usage: python benchmark_data_pipeline.py --context-lengths 64 --context-lengths 512
+"""
+
+import itertools
+import json
+import os
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pyarrow as pa
+import torch
+import typer
+from gluonts.itertools import Cyclic, Map
+from torch.utils.data import DataLoader
+from transformers import default_data_collator
+
+from train import ChronosConfig, create_train_dataset, load_file_dataset
+
+app = typer.Typer(pretty_exceptions_enable=False)
+
+
+def write_synthetic_arrow(path: Path, num_series: int, seed: int = 0):
+    """
+    Random walks of 100 to 3000 steps with 5% missing values, in the schema
+    written by ``getTrainingData.py``.
+    """
+    rng = np.random.default_rng(seed)
+    targets = []
+    for _ in range(num_series):
+        target = rng.normal(size=rng.integers(100, 3000)).cumsum().astype(np.float32)
+        target[rng.random(len(target)) < 0.05] = np.nan
+        targets.append(target)
+    table = pa.table(
+        {
+            "start": pa.array(
+                np.full(num_series, np.datetime64("2000-01-01", "s")),
+                type=pa.timestamp("s"),
+            ),
+            "target": pa.array(targets, type=pa.list_(pa.float32())),
+        }
+    )
+    with pa.ipc.new_file(str(path), table.schema) as writer:
+        writer.write_table(table, max_chunksize=1_000)
+
+
+def measure(iterable, num_items: int) -> dict:
+    start = time.perf_counter()
+    first_item_s, count = None, 0
+    for _ in itertools.islice(iterable, num_items):
+        count += 1
+        if count == 1:
+            first_item_s = time.perf_counter() - start
+    duration = time.perf_counter() - start
+    return {
+        "items": count,
+        # Steady state, without the time until the first item
+        "items_per_s": (count - 1) / (duration - first_item_s) if count > 1 else 0.0,
+        "first_item_s": first_item_s,
+    }
+
+
+def iter_windows(dataset, data):
+    for windows, _ in dataset.sample_training_windows(data):
+        yield from windows
+
+
+@app.command()
+def main(
+    # Training files, a small synthetic Arrow file is generated if not given
+    data_paths: Optional[List[str]] = typer.Option(None),
+    probability: Optional[List[float]] = typer.Option(None),
+    num_synthetic_series: int = 2_000,
+    context_lengths: List[int] = typer.Option([64, 512]),
+    prediction_length: int = 64,
+    min_past: int = 60,
+    max_missing_prop: float = 0.9,
+    # Measure the batched sample conversion of train.py's vectorized option
+    vectorized: bool = False,
+    shuffle_buffer_length: int = 10_000,
+    per_device_train_batch_size: int = 32,
+    dataloader_num_workers: List[int] = typer.Option([0, 1, 2, 4]),
+    # Items measured per stage, the DataLoader stage measures batches
+    num_items: int = 20_000,
+    num_batches: int = 200,
+    n_tokens: int = 4096,
+    seed: int = 0,
+    results_path: str = "data_pipeline.json",
+):
+    tmp_dir = tempfile.TemporaryDirectory()
+    if not data_paths:
+        data_paths = [str(Path(tmp_dir.name) / "synthetic.arrow")]
+        write_synthetic_arrow(Path(data_paths[0]), num_synthetic_series, seed)
+    if not probability:
+        probability = [1.0 / len(data_paths)] * len(data_paths)
+
+    results = []
+
+    def record(stage: str, context_length: int, num_workers=None, **measured):
+        results.append(
+            {
+                "stage": stage,
+                "context_length": context_length,
+                "num_workers": num_workers,
+                **measured,
+            }
+        )
+        workers = f" workers={num_workers}" if num_workers is not None else ""
+        print(
+            f"context_length={context_length:>4} {stage:>18}{workers}: "
+            f"{measured['samples_per_s']:>10,.0f} samples/s, "
+            f"first after {measured['first_item_s']:.2f}s"
+        )
+
+    for context_length in context_lengths:
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        chronos_config = ChronosConfig(
+            tokenizer_class="MeanScaleUniformBins",
+            tokenizer_kwargs={"low_limit": -15.0, "high_limit": 15.0},
+            n_tokens=n_tokens,
+            n_special_tokens=2,
+            pad_token_id=0,
+            eos_token_id=1,
+            use_eos_token=True,
+            model_type="seq2seq",
+            context_length=context_length,
+            prediction_length=prediction_length,
+            num_samples=20,
+            temperature=1.0,
+            top_k=50,
+            top_p=1.0,
+        )
+        dataset = create_train_dataset(
+            training_data_paths=data_paths,
+            probability=probability,
+            chronos_config=chronos_config,
+            min_past=min_past,
+            max_missing_prop=max_missing_prop,
+            seed=seed,
+            vectorized=vectorized,
+        )
+
+        # Stages before the mixture are measured on the first training file
+        decoded = Cyclic(load_file_dataset(Path(data_paths[0])))
+        filtered = Cyclic(dataset.datasets[0])
+        windows = iter_windows(
+            dataset,
+            Map(partial(dataset.preprocess_entry, mode="training"), dataset.datasets[0]),
+        )
+        for stage, iterable in [
+            ("decode", decoded),
+            ("filter", filtered),
+            ("instance_splitter", windows),
+            ("to_hf_format", dataset),
+            ("shuffle_buffer", dataset.shuffle(shuffle_buffer_length)),
+        ]:
+            measured = measure(iter(iterable), num_items)
+            record(
+                stage,
+                context_length,
+                samples_per_s=measured["items_per_s"],
+                **measured,
+            )
+
+        for num_workers in dataloader_num_workers:
+            data_loader = DataLoader(
+                dataset.shuffle(shuffle_buffer_length),
+                batch_size=per_device_train_batch_size,
+                collate_fn=default_data_collator,
+                num_workers=num_workers,
+            )
+            measured = measure(iter(data_loader), num_batches)
+            record(
+                "dataloader",
+                context_length,
+                num_workers=num_workers,
+                samples_per_s=measured["items_per_s"] * per_device_train_batch_size,
+                **measured,
+            )
+
+    with open(results_path, "w") as fp:
+        json.dump(
+            {
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "cpu_count": os.cpu_count(),
+                "torch_version": torch.__version__,
+                "data_paths": data_paths,
+                "prediction_length": prediction_length,
+                "min_past": min_past,
+                "shuffle_buffer_length": shuffle_buffer_length,
+                "per_device_train_batch_size": per_device_train_batch_size,
+                "results": results,
+            },
+            fp,
+            indent=2,
+        )
+    print(f"Results saved to '{results_path}'")
+    tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    app()
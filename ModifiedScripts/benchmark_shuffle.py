@@ -0,0 +1,87 @@
+"""
+Micro-benchmark of the shuffle buffer used for training: compares the
+swap-remove ``PseudoShuffledIterableDataset`` from ``train.py`` with the
+previous implementation that used ``list.pop(idx)`` and one
+``torch.randint`` call per element.
+
+Usage: python benchmark_shuffle.py --num-elements 1000000
+"""
+
+import time
+from typing import List
+
+import numpy as np
+import torch
+import typer
+
+from train import PseudoShuffledIterableDataset
+
+app = typer.Typer(pretty_exceptions_enable=False)
+
+
+class ListPopShuffledIterableDataset(PseudoShuffledIterableDataset):
+    """
+    Previous shuffle buffer implementation, kept as baseline.
+    """
+
+    def __iter__(self):
+        shuffle_buffer = []
+
+        for element in self.base_dataset:
+            shuffle_buffer.append(element)
+            if len(shuffle_buffer) >= self.shuffle_buffer_length:
+                idx = torch.randint(
+                    len(shuffle_buffer), size=(), generator=self.generator
+                )
+                yield shuffle_buffer.pop(idx)
+
+        while shuffle_buffer:
+            idx = torch.randint(len(shuffle_buffer), size=(), generator=self.generator)
+            yield shuffle_buffer.pop(idx)
+
+
+def make_elements(num_elements: int, context_length: int = 512) -> List[dict]:
+    # Small stand-ins for ChronosDataset samples, all referencing the same tensors
+    input_ids = torch.zeros(context_length + 1, dtype=torch.long)
+    return [{"input_ids": input_ids, "idx": i} for i in range(num_elements)]
+
+
+def run(shuffled_dataset) -> tuple:
+    start = time.perf_counter()
+    order = [element["idx"] for element in shuffled_dataset]
+    return len(order) / (time.perf_counter() - start), np.asarray(order)
+
+
+@app.command()
+def main(
+    num_elements: int = 1_000_000,
+    shuffle_buffer_lengths: List[int] = typer.Option([1_000, 10_000, 100_000]),
+    seed: int = 0,
+):
+    elements = make_elements(num_elements)
+
+    for shuffle_buffer_length in shuffle_buffer_lengths:
+        results = {}
+        for name, cls in [
+            ("list.pop", ListPopShuffledIterableDataset),
+            ("swap-remove", PseudoShuffledIterableDataset),
+        ]:
+            shuffled_dataset = cls(elements, shuffle_buffer_length)
+            shuffled_dataset.generator.manual_seed(seed)
+            samples_per_s, order = run(shuffled_dataset)
+            assert np.array_equal(np.sort(order), np.arange(num_elements))
+            # How far elements move on average, should match between implementations
+            displacement = np.abs(order - np.arange(num_elements)).mean()
+            results[name] = samples_per_s
+            print(
+                f"buffer={shuffle_buffer_length:>7} {name:>11}: "
+                f"{samples_per_s:>12,.0f} samples/s, mean displacement {displacement:,.0f}"
+            )
+        print(
+            f"buffer={shuffle_buffer_length:>7} speedup: "
+            f"{results['swap-remove'] / results['list.pop']:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,104 @@
+"""
+Micro-benchmark of training window sampling: compares the native
+``ChronosDataset.sample_training_windows`` from ``train.py`` with the gluonts
+``InstanceSplitter`` + ``ExpectedNumInstanceSampler`` + ``FilterTransformation``
+pipeline it replaced. Both draw the same random numbers, so with the same seed
+they must produce the same windows, which is checked as well.
+
+Usage: python benchmark_window_sampler.py --data-path training_mix.arrow
+"""
+
+import itertools
+import time
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import typer
+from gluonts.itertools import Map
+from gluonts.transform import FilterTransformation
+
+from train import ChronosDataset, load_file_dataset
+
+app = typer.Typer(pretty_exceptions_enable=False)
+
+
+def gluonts_training_windows(dataset: ChronosDataset, data):
+    """
+    Previous training window sampling, kept as baseline.
+    """
+    split_transform = dataset._create_instance_splitter(
+        "training"
+    ) + FilterTransformation(
+        condition=lambda entry: (~np.isnan(entry["past_target"])).sum() > 0
+    )
+    for entry in split_transform.apply(data, is_train=True):
+        yield np.concatenate([entry["past_target"], entry["future_target"]])
+
+
+def native_training_windows(dataset: ChronosDataset, data):
+    for windows, _ in dataset.sample_training_windows(data, cyclic=False):
+        yield from windows
+
+
+def run(windows) -> tuple:
+    start = time.perf_counter()
+    windows = list(windows)
+    return len(windows) / (time.perf_counter() - start), windows
+
+
+@app.command()
+def main(
+    data_path: str = "your/path/to/training_mix.arrow",
+    num_series: int = 100_000,
+    context_length: int = 512,
+    prediction_length: int = 64,
+    min_past: int = 60,
+    seed: int = 0,
+):
+    dataset = ChronosDataset(
+        datasets=[],
+        probabilities=[],
+        tokenizer=None,
+        context_length=context_length,
+        prediction_length=prediction_length,
+        min_past=min_past,
+    )
+    # Series are decoded up front, so only window sampling is timed
+    entries = list(
+        itertools.islice(
+            Map(
+                partial(dataset.preprocess_entry, mode="training"),
+                load_file_dataset(
+                    Path(data_path), min_length=min_past + prediction_length
+                ),
+            ),
+            num_series,
+        )
+    )
+    print(f"Sampling windows from {len(entries)} series")
+
+    results = {}
+    for name, sample in [
+        ("gluonts", gluonts_training_windows),
+        ("native", native_training_windows),
+    ]:
+        np.random.seed(seed)
+        windows_per_s, windows = run(sample(dataset, entries))
+        results[name] = (windows_per_s, windows)
+        print(f"{name:>8}: {windows_per_s:>12,.0f} windows/s, {len(windows)} windows")
+
+    gluonts_windows, native_windows = results["gluonts"][1], results["native"][1]
+    if not gluonts_windows:
+        print("No series long enough for the window geometry")
+        return
+    assert len(gluonts_windows) == len(native_windows)
+    assert all(
+        np.array_equal(a, b, equal_nan=True)
+        for a, b in zip(gluonts_windows, native_windows)
+    )
+    print(f"Identical windows, speedup: {results['native'][0] / results['gluonts'][0]:.1f}x")
+
+
+if __name__ == "__main__":
+    app()
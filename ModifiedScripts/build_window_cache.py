@@ -0,0 +1,119 @@
+"""
+Offline window sampling for training: runs the training-mode
+``InstanceSplitter`` of ``train.py`` over a training file once and stores the
+sampled windows as a memory-mapped array (see ``WindowCache``). Training configs with the same ``prediction_length`` and
+``min_past`` and a ``context_length`` up to the cached one can then list the
+cache directory in ``training_data_paths`` instead of the file, and only
+inject missing values and tokenize batches of windows.
+
+Usage: python build_window_cache.py --data-path training_mix.arrow \\
+    --context-length 512 --prediction-length 64 --min-past 60
+"""
+
+import json
+import os
+from functools import partial
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import typer
+from gluonts.itertools import Map
+from tqdm import tqdm
+
+from train import (
+    ChronosDataset,
+    get_window_cache_path,
+    load_file_dataset,
+)
+
+app = typer.Typer(pretty_exceptions_enable=False)
+
+
+@app.command()
+def main(
+    data_path: str = "your/path/to/training_mix.arrow",
+    context_length: int = 512,
+    prediction_length: int = 64,
+    min_past: int = 64,
+    max_missing_prop: float = 0.9,
+    # Passes of the instance sampler over the data, each samples about one window per series
+    num_passes: int = 1,
+    chunk_size: int = 10_000,
+    seed: int = 0,
+    output_path: Optional[str] = None,
+):
+    data_path = Path(data_path)
+    output_path = (
+        Path(output_path)
+        if output_path is not None
+        else get_window_cache_path(data_path, context_length, prediction_length, min_past)
+    )
+    output_path.mkdir(parents=True, exist_ok=True)
+    # Written last, a cache without it is incomplete and not picked up by train.py
+    (output_path / "windows.json").unlink(missing_ok=True)
+
+    # Same filtering and window sampling as the training mode of train.py,
+    # missing values are injected at training time
+    dataset = load_file_dataset(
+        data_path,
+        min_length=min_past + prediction_length,
+        max_missing_prop=max_missing_prop,
+    )
+    chronos_dataset = ChronosDataset(
+        datasets=[dataset],
+        probabilities=[1.0],
+        tokenizer=None,
+        context_length=context_length,
+        prediction_length=prediction_length,
+        drop_prob=0.0,
+        min_past=min_past,
+        mode="training",
+    )
+    # The gluonts instance samplers draw from the global numpy generator
+    np.random.seed(seed)
+
+    num_windows = 0
+    with open(output_path / "windows.f32", "wb") as windows_fp:
+
+        def write_chunk(chunk):
+            windows_fp.write(np.stack(chunk).astype(np.float32, copy=False).tobytes())
+
+        for _ in range(num_passes):
+            entries = chronos_dataset.create_training_data(
+                Map(partial(chronos_dataset.preprocess_entry, mode="training"), dataset),
+                cyclic=False,
+            )
+            chunk = []
+            for entry in tqdm(entries, desc="Sampling windows"):
+                chunk.append(
+                    np.concatenate([entry["past_target"], entry["future_target"]])
+                )
+                if len(chunk) == chunk_size:
+                    write_chunk(chunk)
+                    num_windows += len(chunk)
+                    chunk = []
+            if chunk:
+                write_chunk(chunk)
+                num_windows += len(chunk)
+
+    with open(output_path / "windows.json", "w") as fp:
+        json.dump(
+            {
+                "source": os.path.relpath(data_path, output_path),
+                "context_length": context_length,
+                "prediction_length": prediction_length,
+                "min_past": min_past,
+                "max_missing_prop": max_missing_prop,
+                "num_passes": num_passes,
+                "seed": seed,
+                "num_windows": num_windows,
+            },
+            fp,
+            indent=2,
+        )
+    print(f"{num_windows} windows saved to '{output_path}'")
+
+
+if __name__ == "__main__":
+    app()
@@ -3,27 +3,40 @@
 
 print("Python Script Huggingface Data!")
 
+import time
+
+IMPORT_START = time.perf_counter()
+
+import abc
 import ast
+import fcntl
+import hashlib
 import logging
 import os
 import re
+import shutil
 import sys
+import threading
 import json
 import itertools
 import random
-from copy import deepcopy
+import sqlite3
+from collections import OrderedDict
+from copy import copy, deepcopy
 from pathlib import Path
 from functools import partial
-from typing import List, Iterator, Optional, Dict
+from typing import List, Iterator, Optional, Dict, Tuple
 
 import typer
 
 from typer_config import use_yaml_config
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pyarrow as pa
 import torch
 import torch.distributed as dist
-from torch.utils.data import IterableDataset, get_worker_info
+from torch.utils.data import DataLoader, Dataset, IterableDataset, get_worker_info
 import transformers
 from transformers import (
     AutoModelForSeq2SeqLM,
@@ -31,15 +44,16 @@ from transformers import (
     AutoConfig,
     T5Config,
     Trainer,
+    TrainerCallback,
     TrainingArguments,
 )
 
 import accelerate
 import gluonts
-from gluonts.dataset.common import FileDataset
-from gluonts.itertools import Cyclic, Map, Filter
+from gluonts.dataset.arrow.dec import ArrowDecoder
+from gluonts.dataset.common import FileDataset, ProcessDataEntry
+from gluonts.itertools import Cyclic, Map, Filter, Chain
 from gluonts.transform import (
-    FilterTransformation,
     TestSplitSampler,
     ValidationSplitSampler,
     InstanceSplitter,
@@ -55,8 +69,10 @@ from chronos.chronos import ChronosConfig, ChronosTokenizer
 
 
 app = typer.Typer(pretty_exceptions_enable=False)
+logger = logging.getLogger(__file__)
 
 print("Finished Imports")
+IMPORT_END = time.perf_counter()
 
 
 def is_main_process() -> bool:
@@ -68,6 +84,16 @@ def is_main_process() -> bool:
     return int(os.environ["RANK"]) == 0
 
 
+def get_rank_and_world_size():
+    """
+    Return the rank of this process and the number of processes, when
+    launched with torchrun, and ``(0, 1)`` otherwise.
+    """
+    if not dist.is_torchelastic_launched():
+        return 0, 1
+    return int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"])
+
+
 def log_on_main(msg: str, logger: logging.Logger, log_level: int = logging.INFO):
     """
     Log the given message using the given logger, if we're on the main process.
@@ -161,6 +187,57 @@ def get_next_path(
     return base_dir / fname
 
 
+def is_complete_checkpoint(ckpt_path: Path) -> bool:
+    """
+    Check whether all files needed to resume training were written to a
+    ``Trainer`` checkpoint; a job killed while saving leaves some of them out.
+    """
+    return all(
+        (ckpt_path / fname).is_file()
+        for fname in ["trainer_state.json", "optimizer.pt", "scheduler.pt"]
+    ) and any(
+        (ckpt_path / fname).is_file()
+        for fname in [
+            "model.safetensors",
+            "model.safetensors.index.json",
+            "pytorch_model.bin",
+        ]
+    )
+
+
+def get_last_checkpoint(run_dir: Path) -> Optional[Path]:
+    """
+    Gets the ``checkpoint-<step>`` directory of a run with the highest step
+    that is complete, or None if there is none.
+    """
+    checkpoints = filter(
+        lambda x: x.is_dir()
+        and re.match("^checkpoint-\\d+$", x.name)
+        and is_complete_checkpoint(x),
+        run_dir.glob("checkpoint-*"),
+    )
+    return max(
+        checkpoints, key=lambda x: int(x.name.replace("checkpoint-", "")), default=None
+    )
+
+
+def get_interrupted_run(base_dir: Path, base_fname: str = "run") -> Optional[Path]:
+    """
+    Gets the last ``run-N`` directory in ``base_dir`` if its training did not
+    finish, i.e. it has no ``checkpoint-final``, otherwise None.
+    """
+    runs = filter(
+        lambda x: x.is_dir() and re.match(f"^{base_fname}-\\d+$", x.name),
+        base_dir.glob("*"),
+    )
+    last_run = max(
+        runs, key=lambda x: int(x.name.replace(f"{base_fname}-", "")), default=None
+    )
+    if last_run is None or (last_run / "checkpoint-final").exists():
+        return None
+    return last_run
+
+
 #modified load model fúnction to implement additional hyperparameter
 def load_model(
     model_id="google/t5-efficient-tiny",
@@ -177,7 +254,9 @@ def load_model(
     is_encoder_decoder = True,
     num_layers = 6,
     num_heads = 8,
-    d_ff = 2048
+    d_ff = 2048,
+    attn_implementation = None,
+    warm_start_from = None,
 
 ):
     """
@@ -185,12 +264,21 @@ def load_model(
     size, special token IDs, and initialization options.
 
     This allows to set a model up for training on a new vocabulary
-    of tokens.
+    of tokens. ``attn_implementation`` (e.g. "eager") overrides the
+    attention kernels chosen by transformers. With ``warm_start_from``,
+    the randomly initialized model is grown from that trained, smaller
+    checkpoint (see ``grow_model``).
     """
+    assert warm_start_from is None or random_init, "warm starts need random_init"
     assert model_type in ["seq2seq", "causal"]
     AutoModelClass = (
         AutoModelForSeq2SeqLM if model_type == "seq2seq" else AutoModelForCausalLM
     )
+    model_kwargs = (
+        {"attn_implementation": attn_implementation}
+        if attn_implementation is not None
+        else {}
+    )
     if random_init:
         log_on_main("Using random initialization", logger)
         config = AutoConfig.from_pretrained(model_id)
@@ -206,20 +294,924 @@ def load_model(
             # The default initializer_factor (1.0) in transformers is too large
             config.initializer_factor = 0.05
         config.tie_word_embeddings = tie_embeddings
-        model = AutoModelClass.from_config(config)
+        model = AutoModelClass.from_config(config, **model_kwargs)
     else:
         log_on_main(f"Using pretrained initialization from {model_id}", logger)
-        model = AutoModelClass.from_pretrained(model_id)
+        model = AutoModelClass.from_pretrained(model_id, **model_kwargs)
 
     model.resize_token_embeddings(vocab_size)
     model
 
+    if warm_start_from is not None:
+        log_on_main(f"Growing the model from {warm_start_from}", logger)
+        grow_model(AutoModelClass.from_pretrained(warm_start_from), model)
+
     model.config.pad_token_id = model.generation_config.pad_token_id = pad_token_id
     model.config.eos_token_id = model.generation_config.eos_token_id = eos_token_id
 
     return model
 
 
+def grow_model(source, model):
+    """
+    Initialize ``model`` from the trained ``source`` T5 model with the same
+    heads and vocabulary and at most as many layers, ``d_model`` and ``d_ff``,
+    such that it computes the same function (up to the layer norm epsilon).
+
+    The weights of ``source`` are copied into the leading slice of every
+    weight of ``model``. Of the new entries, those that read from the new
+    ``d_model`` dimensions or feed the new ``d_ff`` units keep their random
+    initialization, while those that write into the residual stream
+    (embeddings, attention output and ``wo`` projections) are zero, so the
+    new dimensions and units start without effect but receive gradients
+    (Net2Net widening, with zero instead of replicated outgoing weights).
+    New layers are appended to each stack with zero output projections, so
+    they start as the identity. The layer norm weights are rescaled for the
+    RMS over the zero-padded residual stream.
+    """
+    assert isinstance(source.config, T5Config) and isinstance(model.config, T5Config)
+    for key in [
+        "vocab_size",
+        "num_heads",
+        "d_kv",
+        "feed_forward_proj",
+        "relative_attention_num_buckets",
+    ]:
+        assert getattr(source.config, key) == getattr(model.config, key), (
+            f"can't grow {key} from {getattr(source.config, key)} "
+            f"to {getattr(model.config, key)}"
+        )
+    for key in ["d_model", "d_ff", "num_layers", "num_decoder_layers"]:
+        assert getattr(source.config, key) <= getattr(model.config, key), (
+            f"can't shrink {key} from {getattr(source.config, key)} "
+            f"to {getattr(model.config, key)}"
+        )
+
+    def is_tied(m):
+        return m.get_output_embeddings().weight is m.get_input_embeddings().weight
+
+    assert is_tied(source) == is_tied(model), "can't grow tied from untied embeddings"
+    # The decoder output is scaled by d_model ** -0.5 with tied embeddings
+    # (a separate config flag in recent transformers versions)
+    scales_output = getattr(
+        model.config, "scale_decoder_outputs", model.config.tie_word_embeddings
+    )
+
+    # The RMS of the padded residual stream is smaller by this factor
+    norm_scale = (source.config.d_model / model.config.d_model) ** 0.5
+    source_state = source.state_dict()
+    with torch.no_grad():
+        for name, param in model.state_dict().items():
+            writes_residual = name.endswith(
+                (".o.weight", ".wo.weight", "shared.weight", "embed_tokens.weight")
+            )
+            if writes_residual:
+                param.zero_()
+            if name not in source_state:
+                # A new layer
+                continue
+
+            value = source_state[name]
+            if "layer_norm" in name and not (
+                # The larger d_model ** -0.5 of the output scaling compensates
+                # the smaller RMS of the final layer norm
+                name == "decoder.final_layer_norm.weight"
+                and scales_output
+            ):
+                value = value * norm_scale
+            param[tuple(slice(0, size) for size in value.shape)] = value
+
+
+def get_stats_path(data_path: Path) -> Path:
+    """
+    Path of the per-series statistics sidecar that ``getTrainingData.py``
+    writes next to each Arrow file, e.g. ``training_mix.stats.arrow``.
+    """
+    return data_path.with_suffix(".stats.arrow")
+
+
+def get_subset_mask(stats: pa.Table, data_fraction: float, path: Path) -> np.ndarray:
+    """
+    Mask of the series in a statistics sidecar that belong to the
+    ``data_fraction`` subset: those whose content hash falls into the first
+    ``data_fraction`` of the hash range. The subsets are deterministic and
+    nested, every series of a subset is also in those of larger fractions.
+    """
+    if data_fraction >= 1.0:
+        return np.ones(stats.num_rows, dtype=bool)
+    assert "content_hash" in stats.column_names, (
+        f"{get_stats_path(path)} has no content hashes, "
+        "recreate it with getTrainingData.py --stats-only"
+    )
+    content_hash = stats.column("content_hash").to_numpy()
+    # Top 53 bits of the hash as a uniform number in [0, 1)
+    return (content_hash >> np.uint64(11)).astype(np.float64) * 2.0**-53 < data_fraction
+
+
+def read_stats(path: Path) -> pa.Table:
+    """
+    Read the statistics sidecar of an Arrow file.
+    """
+    with pa.memory_map(str(get_stats_path(path))) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def is_arrow_file(data_path: Path) -> bool:
+    """
+    Check if the given path is an Arrow file in the random-access format,
+    which starts with ``ARROW1``.
+    """
+    if not data_path.is_file():
+        return False
+    with open(data_path, "rb") as fp:
+        return fp.read(6) == b"ARROW1"
+
+
+class FilteredArrowFile:
+    """
+    Arrow file dataset that only yields the series which pass
+    ``has_enough_observations``, and that can be split into disjoint parts
+    for several consumers (e.g. DataLoader workers) via ``shard``.
+
+    If the per-series statistics sidecar exists, eligibility is decided up
+    front and ineligible series are never decoded; shards are then equally
+    sized, contiguous ranges of eligible rows. Without a sidecar every series
+    is decoded and checked, and record batches are assigned to shards
+    round-robin; a file with fewer record batches than shards is split by
+    series instead (see ``StridedDataset``).
+
+    The first pass starts after the first ``position`` series (see
+    ``skip_dataset``); without a sidecar, ineligible series are counted too.
+
+    Parameters
+    ----------
+    path
+        Path to the Arrow file.
+    min_length
+        The minimum length the ``"target"`` attribute must have.
+    max_missing_prop
+        The maximum proportion of missing data allowed in the ``"target"``
+        attribute.
+    data_fraction
+        Only yield the deterministic subset of this fraction of the series
+        (see ``get_subset_mask``), requires the statistics sidecar.
+    freq
+        Frequency used to process the ``"start"`` attribute.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        min_length: int = 0,
+        max_missing_prop: float = 1.0,
+        data_fraction: float = 1.0,
+        freq: str = "h",
+    ) -> None:
+        self.path = path
+        self.min_length = min_length
+        self.max_missing_prop = max_missing_prop
+        self.process = ProcessDataEntry(freq, one_dim_target=True)
+
+        if get_stats_path(path).exists():
+            stats = read_stats(path)
+            eligible = (
+                (stats.column("length").to_numpy() >= min_length)
+                & (stats.column("nan_fraction").to_numpy() <= max_missing_prop)
+                & get_subset_mask(stats, data_fraction, path)
+            )
+            self.batch_index = stats.column("batch_index").to_numpy()[eligible]
+            self.row_index = stats.column("row_index").to_numpy()[eligible]
+            self.record_batches = None
+        else:
+            assert data_fraction >= 1.0, f"data_fraction requires {get_stats_path(path)}"
+            with pa.memory_map(str(path)) as source:
+                num_record_batches = pa.ipc.open_file(source).num_record_batches
+            self.batch_index = self.row_index = None
+            self.record_batches = np.arange(num_record_batches)
+        self._group_rows()
+        self.position = 0
+
+    def _group_rows(self):
+        # Eligible rows, grouped by the record batch they are stored in
+        if self.batch_index is not None:
+            batches, starts = np.unique(self.batch_index, return_index=True)
+            self.rows_per_batch = list(
+                zip(batches, np.split(self.row_index, starts[1:]))
+            )
+
+    def shard(self, index: int, num_shards: int):
+        """
+        Return the ``index``-th of ``num_shards`` disjoint parts of this file.
+        """
+        if self.batch_index is None and len(self.record_batches) < num_shards:
+            # Some shards would get no record batch at all
+            return StridedDataset(self, index, num_shards)
+        sharded = copy(self)
+        if self.batch_index is not None:
+            start = len(self.batch_index) * index // num_shards
+            stop = len(self.batch_index) * (index + 1) // num_shards
+            sharded.batch_index = self.batch_index[start:stop]
+            sharded.row_index = self.row_index[start:stop]
+            sharded._group_rows()
+        else:
+            sharded.record_batches = self.record_batches[index::num_shards]
+        # Shards are read at the same pace
+        sharded.position = self.position // num_shards
+        return sharded
+
+    def num_series(self) -> int:
+        """
+        Number of series in a pass: the eligible ones if the sidecar exists,
+        all series of the record batches otherwise.
+        """
+        if self.batch_index is not None:
+            return len(self.batch_index)
+        with pa.memory_map(str(self.path)) as source:
+            reader = pa.ipc.open_file(source)
+            return sum(reader.get_batch(int(i)).num_rows for i in self.record_batches)
+
+    def __iter__(self):
+        # Only the first pass starts after the skipped series
+        offset = self.position % max(self.num_series(), 1) if self.position else 0
+        self.position = 0
+
+        with pa.memory_map(str(self.path)) as source:
+            reader = pa.ipc.open_file(source)
+            decoder = ArrowDecoder.from_schema(reader.schema)
+
+            if self.batch_index is not None:
+                for batch_index, rows in self.rows_per_batch:
+                    if offset >= len(rows):
+                        offset -= len(rows)
+                        continue
+                    batch = reader.get_batch(int(batch_index)).take(
+                        pa.array(rows[offset:])
+                    )
+                    offset = 0
+                    for entry in decoder.decode_batch(batch):
+                        yield self.process(entry)
+                return
+
+            for batch_index in self.record_batches:
+                batch = reader.get_batch(int(batch_index))
+                if offset >= batch.num_rows:
+                    offset -= batch.num_rows
+                    continue
+                batch, offset = batch.slice(offset), 0
+                for entry in decoder.decode_batch(batch):
+                    entry = self.process(entry)
+                    if has_enough_observations(
+                        entry,
+                        min_length=self.min_length,
+                        max_missing_prop=self.max_missing_prop,
+                    ):
+                        yield entry
+
+
+class IndexedArrowDataset:
+    """
+    Random-access dataset over the series of one or more Arrow files that
+    pass ``has_enough_observations``. Every pass over the dataset visits all
+    series in a new random permutation, so samples are shuffled globally
+    without a shuffle buffer that has to be filled first.
+
+    The location (file, record batch, row) of every eligible series is indexed
+    up front, from the statistics sidecar if it exists, and by scanning the
+    file otherwise. Parts obtained via ``shard`` share the permutation of
+    every pass and each take every ``num_shards``-th series of it. Iteration
+    starts at ``position`` in the concatenated permutations of all passes
+    (see ``skip_dataset``), i.e. at its remainder in the permutation of pass
+    ``position // len(self)``.
+
+    Record batches of uncompressed files are read from the memory-mapped file
+    without copies. Compressed record batches are decompressed whenever they
+    are accessed, which makes random access slow, so files converted with
+    ``--compression uncompressed`` should be used.
+
+    Parameters
+    ----------
+    paths
+        Paths to the Arrow files.
+    min_length
+        The minimum length the ``"target"`` attribute must have.
+    max_missing_prop
+        The maximum proportion of missing data allowed in the ``"target"``
+        attribute.
+    seed
+        Seed of the permutations; the permutation of the ``i``-th pass only
+        depends on ``seed`` and ``i``.
+    data_fraction
+        Only index the deterministic subset of this fraction of the series
+        (see ``get_subset_mask``), requires the statistics sidecars.
+    freq
+        Frequency used to process the ``"start"`` attribute.
+    """
+
+    max_cached_batches = 16
+
+    def __init__(
+        self,
+        paths: List[Path],
+        min_length: int = 0,
+        max_missing_prop: float = 1.0,
+        seed: int = 0,
+        data_fraction: float = 1.0,
+        freq: str = "h",
+    ) -> None:
+        self.paths = paths
+        self.seed = seed
+        self.process = ProcessDataEntry(freq, one_dim_target=True)
+
+        file_index, batch_index, row_index = [], [], []
+        for i, path in enumerate(paths):
+            batches, rows = self._build_index(
+                path, min_length, max_missing_prop, data_fraction
+            )
+            file_index.append(np.full(len(rows), i, dtype=np.int32))
+            batch_index.append(batches)
+            row_index.append(rows)
+        self.file_index = np.concatenate(file_index)
+        self.batch_index = np.concatenate(batch_index)
+        self.row_index = np.concatenate(row_index)
+
+        self.shard_index, self.num_shards = 0, 1
+        self.position = 0
+
+    @staticmethod
+    def _build_index(
+        path: Path, min_length: int, max_missing_prop: float, data_fraction: float
+    ):
+        in_subset = True
+        if get_stats_path(path).exists():
+            stats = read_stats(path)
+            length = stats.column("length").to_numpy()
+            nan_fraction = stats.column("nan_fraction").to_numpy()
+            batch_index = stats.column("batch_index").to_numpy()
+            row_index = stats.column("row_index").to_numpy()
+            in_subset = get_subset_mask(stats, data_fraction, path)
+        else:
+            assert data_fraction >= 1.0, f"data_fraction requires {get_stats_path(path)}"
+            length, nan_fraction, batch_index, row_index = [], [], [], []
+            with pa.memory_map(str(path)) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    target = reader.get_batch(i).column("target")
+                    offsets = target.offsets.to_numpy()
+                    num_nan = np.concatenate(
+                        [[0], np.cumsum(np.isnan(target.values.to_numpy()))]
+                    )
+                    length.append(np.diff(offsets))
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        nan_fraction.append(
+                            (num_nan[offsets[1:]] - num_nan[offsets[:-1]])
+                            / length[-1]
+                        )
+                    batch_index.append(np.full(len(target), i, dtype=np.int32))
+                    row_index.append(np.arange(len(target), dtype=np.int32))
+            length, nan_fraction, batch_index, row_index = map(
+                np.concatenate, (length, nan_fraction, batch_index, row_index)
+            )
+        eligible = (length >= min_length) & (nan_fraction <= max_missing_prop) & in_subset
+        return batch_index[eligible], row_index[eligible]
+
+    def __len__(self) -> int:
+        return len(self.row_index)
+
+    def shard(self, index: int, num_shards: int) -> "IndexedArrowDataset":
+        """
+        Return the ``index``-th of ``num_shards`` disjoint parts of the dataset.
+        """
+        sharded = copy(self)
+        sharded.shard_index, sharded.num_shards = index, num_shards
+        return sharded
+
+    def __iter__(self):
+        if len(self) == 0:
+            return
+        epoch, offset = divmod(self.position, len(self))
+        permutation = np.random.default_rng([self.seed, epoch]).permutation(len(self))
+        self.position = (epoch + 1) * len(self)
+        # First series of this shard at or after the offset
+        first = offset + (self.shard_index - offset) % self.num_shards
+
+        sources = [pa.memory_map(str(path)) for path in self.paths]
+        readers = [pa.ipc.open_file(source) for source in sources]
+        # (start, values, offsets) of the most recently used record batches
+        batches = OrderedDict()
+        try:
+            for i in permutation[first :: self.num_shards]:
+                key = (self.file_index[i], self.batch_index[i])
+                if key in batches:
+                    batches.move_to_end(key)
+                else:
+                    batch = readers[key[0]].get_batch(int(key[1]))
+                    target = batch.column("target")
+                    batches[key] = (
+                        batch.column("start").to_numpy(),
+                        target.values.to_numpy(),
+                        target.offsets.to_numpy(),
+                    )
+                    if len(batches) > self.max_cached_batches:
+                        batches.popitem(last=False)
+
+                start, values, offsets = batches[key]
+                row = self.row_index[i]
+                target = values[offsets[row] : offsets[row + 1]]
+                yield self.process({"start": start[row], "target": target})
+        finally:
+            for source in sources:
+                source.close()
+
+
+def get_shared_corpus_path(paths: List[Path], shared_dir: Path) -> Path:
+    """
+    Directory of the decoded copy of the given Arrow files in ``shared_dir``.
+    The name depends on the location, size and modification time of the
+    files, so a stale copy is never attached to.
+    """
+    key = json.dumps(
+        [[str(path.resolve()), path.stat().st_size, path.stat().st_mtime_ns] for path in paths]
+    )
+    return shared_dir / f"{paths[0].stem}-{hashlib.sha1(key.encode()).hexdigest()[:16]}"
+
+
+def create_shared_corpus(paths: List[Path], corpus_path: Path):
+    """
+    Decode the series of the given Arrow files into flat arrays: ``values.f32``
+    (all targets, concatenated), ``offsets.i64`` (start of every target in
+    ``values.f32``, plus the end of the last one), ``start.i64`` (start
+    timestamps in seconds) and ``num_nan.i64`` (missing values per series).
+    The arrays are written to a temporary directory that is renamed to
+    ``corpus_path`` once complete.
+    """
+    tmp_path = corpus_path.with_name(f"{corpus_path.name}.tmp{os.getpid()}")
+    tmp_path.mkdir(parents=True)
+
+    offsets, start, num_nan = [np.zeros(1, dtype=np.int64)], [], []
+    with open(tmp_path / "values.f32", "wb") as fp:
+        for path in paths:
+            with pa.memory_map(str(path)) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    batch = reader.get_batch(i)
+                    target = batch.column("target")
+                    values = np.asarray(
+                        target.flatten().to_numpy(zero_copy_only=False),
+                        dtype=np.float32,
+                    )
+                    batch_offsets = target.offsets.to_numpy().astype(np.int64)
+                    batch_offsets -= batch_offsets[0]
+                    cum_nan = np.concatenate([[0], np.cumsum(np.isnan(values))])
+
+                    fp.write(values.tobytes())
+                    offsets.append(batch_offsets[1:] + offsets[-1][-1])
+                    num_nan.append(
+                        cum_nan[batch_offsets[1:]] - cum_nan[batch_offsets[:-1]]
+                    )
+                    start.append(
+                        batch.column("start")
+                        .to_numpy()
+                        .astype("datetime64[s]")
+                        .astype(np.int64)
+                    )
+
+    for name, arrays in [("offsets", offsets), ("start", start), ("num_nan", num_nan)]:
+        np.concatenate(arrays).astype(np.int64).tofile(tmp_path / f"{name}.i64")
+    with open(tmp_path / "corpus.json", "w") as fp:
+        json.dump(
+            {
+                "paths": [str(path) for path in paths],
+                "num_series": int(sum(len(array) for array in start)),
+                "num_values": int(offsets[-1][-1]),
+            },
+            fp,
+            indent=2,
+        )
+    os.rename(tmp_path, corpus_path)
+
+
+def load_shared_corpus(paths: List[Path], shared_dir: Path) -> Path:
+    """
+    Return the directory of the decoded copy of the given Arrow files in
+    ``shared_dir`` (e.g. ``/dev/shm/chronos``), decoding them first if no
+    process on this node has done so yet. Concurrent callers wait for the
+    decoding process and then attach to its copy. Temporary directories left
+    behind by a decoding process that was killed are removed.
+    """
+    corpus_path = get_shared_corpus_path(paths, shared_dir)
+    shared_dir.mkdir(parents=True, exist_ok=True)
+    with open(corpus_path.with_name(f"{corpus_path.name}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not (corpus_path / "corpus.json").exists():
+            # Only the holder of the lock decodes, so any temporary copy is stale
+            for tmp_path in shared_dir.glob(f"{corpus_path.name}.tmp*"):
+                shutil.rmtree(tmp_path)
+            create_shared_corpus(paths, corpus_path)
+    return corpus_path
+
+
+class SharedCorpusDataset:
+    """
+    Dataset over a corpus decoded by ``load_shared_corpus``, typically kept in
+    shared memory (tmpfs) so that all training processes and DataLoader
+    workers on a node read the same single copy of the decoded data instead
+    of decoding the Arrow files themselves. Only series that pass
+    ``has_enough_observations`` are yielded.
+
+    With ``random_access``, every pass visits the series in a new permutation
+    as in ``IndexedArrowDataset``, and parts obtained via ``shard`` take every
+    ``num_shards``-th series of it. Otherwise series are yielded in corpus
+    order and shards are equally sized, contiguous ranges of series. In both
+    cases iteration starts at ``position`` in the series of all passes (see
+    ``skip_dataset``).
+
+    Parameters
+    ----------
+    path
+        Directory of the decoded corpus.
+    min_length
+        The minimum length the ``"target"`` attribute must have.
+    max_missing_prop
+        The maximum proportion of missing data allowed in the ``"target"``
+        attribute.
+    random_access
+        Visit the series in a new random order on every pass.
+    seed
+        Seed of the permutations.
+    data_fraction
+        Only yield the deterministic subset of this fraction of the series
+        (see ``get_subset_mask``).
+    source_paths
+        The Arrow files decoded into the corpus, whose statistics sidecars
+        are required for ``data_fraction``.
+    freq
+        Frequency used to process the ``"start"`` attribute.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        min_length: int = 0,
+        max_missing_prop: float = 1.0,
+        random_access: bool = False,
+        seed: int = 0,
+        data_fraction: float = 1.0,
+        source_paths: Optional[List[Path]] = None,
+        freq: str = "h",
+    ) -> None:
+        self.path = path
+        self.random_access = random_access
+        self.seed = seed
+        self.process = ProcessDataEntry(freq, one_dim_target=True)
+
+        length = np.diff(np.fromfile(path / "offsets.i64", dtype=np.int64))
+        num_nan = np.fromfile(path / "num_nan.i64", dtype=np.int64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            eligible = (length >= min_length) & (num_nan / length <= max_missing_prop)
+        if data_fraction < 1.0:
+            # The corpus holds the series of its files in file order, as the sidecars
+            assert source_paths is not None
+            for source_path in source_paths:
+                assert get_stats_path(
+                    source_path
+                ).exists(), f"data_fraction requires {get_stats_path(source_path)}"
+            eligible &= np.concatenate(
+                [
+                    get_subset_mask(read_stats(source_path), data_fraction, source_path)
+                    for source_path in source_paths
+                ]
+            )
+        self.rows = np.flatnonzero(eligible)
+
+        self.shard_index, self.num_shards = 0, 1
+        self.position = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def shard(self, index: int, num_shards: int) -> "SharedCorpusDataset":
+        """
+        Return the ``index``-th of ``num_shards`` disjoint parts of the dataset.
+        """
+        sharded = copy(self)
+        if self.random_access:
+            sharded.shard_index, sharded.num_shards = index, num_shards
+        else:
+            start = len(self.rows) * index // num_shards
+            stop = len(self.rows) * (index + 1) // num_shards
+            sharded.rows = self.rows[start:stop]
+            # Shards are read at the same pace
+            sharded.position = self.position // num_shards
+        return sharded
+
+    def __iter__(self):
+        # Mapped here rather than in __init__, since the dataset is pickled to
+        # DataLoader workers
+        offsets = np.memmap(self.path / "offsets.i64", dtype=np.int64, mode="r")
+        start = (
+            np.memmap(self.path / "start.i64", dtype=np.int64, mode="r")
+            if len(offsets) > 1
+            else np.empty(0, dtype=np.int64)
+        )
+        values = (
+            np.memmap(self.path / "values.f32", dtype=np.float32, mode="r")
+            if offsets[-1] > 0
+            else np.empty(0, dtype=np.float32)
+        )
+
+        if len(self.rows) == 0:
+            return
+        epoch, offset = divmod(self.position, len(self.rows))
+        self.position = (epoch + 1) * len(self.rows)
+        if self.random_access:
+            permutation = np.random.default_rng([self.seed, epoch]).permutation(
+                len(self.rows)
+            )
+            # First series of this shard at or after the offset
+            first = offset + (self.shard_index - offset) % self.num_shards
+            rows = self.rows[permutation[first :: self.num_shards]]
+        else:
+            rows = self.rows[offset:]
+
+        for row in rows:
+            yield self.process(
+                {
+                    "start": np.datetime64(int(start[row]), "s"),
+                    "target": np.array(values[offsets[row] : offsets[row + 1]]),
+                }
+            )
+
+
+class StridedDataset:
+    """
+    Every ``step``-th entry of a dataset, starting with the ``start``-th.
+    Used to split datasets that cannot be sharded without decoding them.
+    """
+
+    def __init__(self, dataset, start: int, step: int) -> None:
+        self.dataset = dataset
+        self.start = start
+        self.step = step
+
+    def __iter__(self):
+        return itertools.islice(self.dataset, self.start, None, self.step)
+
+
+def get_window_cache_path(
+    data_path: Path, context_length: int, prediction_length: int, min_past: int
+) -> Path:
+    """
+    Directory of the training windows that ``build_window_cache.py`` samples
+    from a training file for the given window geometry, e.g.
+    ``training_mix.windows-512-64-60``.
+    """
+    return data_path.with_name(
+        f"{data_path.stem}.windows-{context_length}-{prediction_length}-{min_past}"
+    )
+
+
+def is_window_cache(data_path: Path) -> bool:
+    """
+    Check if the given path is a complete window cache directory.
+    """
+    return (data_path / "windows.json").is_file()
+
+
+class WindowCache:
+    """
+    Training windows pre-sampled by ``build_window_cache.py``, stored as a
+    memory-mapped float32 array: ``windows.f32`` holds one row of
+    ``context_length + prediction_length`` values per window (the context
+    left-padded with NaN, as done by ``InstanceSplitter``).
+
+    Windows can be split into disjoint parts via ``shard``; shards are equally
+    sized, contiguous ranges of windows.
+
+    Parameters
+    ----------
+    path
+        Path to the cache directory.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with open(path / "windows.json") as fp:
+            meta = json.load(fp)
+        self.context_length = meta["context_length"]
+        self.prediction_length = meta["prediction_length"]
+        self.min_past = meta["min_past"]
+        self.num_windows = meta["num_windows"]
+        self.start, self.stop = 0, self.num_windows
+
+    def shard(self, index: int, num_shards: int) -> "WindowCache":
+        """
+        Return the ``index``-th of ``num_shards`` disjoint parts of the cache.
+        """
+        sharded = copy(self)
+        num_windows = self.stop - self.start
+        sharded.start = self.start + num_windows * index // num_shards
+        sharded.stop = self.start + num_windows * (index + 1) // num_shards
+        return sharded
+
+    def open(self):
+        """
+        Memory-map the windows. Not done in ``__init__``, since the cache is
+        pickled to every DataLoader worker.
+        """
+        if self.num_windows == 0:
+            return np.empty(
+                (0, self.context_length + self.prediction_length), dtype=np.float32
+            )
+        return np.memmap(
+            self.path / "windows.f32",
+            dtype=np.float32,
+            mode="r",
+            shape=(self.num_windows, self.context_length + self.prediction_length),
+        )
+
+
+def get_num_entries(dataset) -> Optional[int]:
+    """
+    Number of series (of windows for a ``WindowCache``) of a dataset returned
+    by ``load_file_dataset``, or None if it is not known without decoding it.
+    """
+    if isinstance(dataset, FilteredArrowFile):
+        return None if dataset.batch_index is None else len(dataset.batch_index)
+    if isinstance(dataset, (IndexedArrowDataset, SharedCorpusDataset)):
+        return len(dataset)
+    if isinstance(dataset, WindowCache):
+        return dataset.stop - dataset.start
+    return None
+
+
+def shard_dataset(dataset, index: int, num_shards: int):
+    """
+    Return the ``index``-th of ``num_shards`` disjoint parts of a dataset
+    returned by ``load_file_dataset``, so that several consumers (e.g.
+    DataLoader workers) can read the same dataset without repeating samples.
+
+    A dataset with fewer entries than consumers is not split: the consumers
+    of empty parts would otherwise train without it, and the mixture would
+    differ between workers and ranks.
+    """
+    if num_shards == 1:
+        return dataset
+    num_entries = get_num_entries(dataset)
+    if num_entries is not None and 0 < num_entries < num_shards:
+        if index == 0:
+            logger.warning(
+                f"Not sharding a dataset of {num_entries} entries across "
+                f"{num_shards} workers, every worker reads all of it"
+            )
+        return dataset
+    if isinstance(
+        dataset,
+        (FilteredArrowFile, IndexedArrowDataset, SharedCorpusDataset, WindowCache),
+    ):
+        return dataset.shard(index, num_shards)
+    if isinstance(dataset, Chain):
+        return Chain(
+            [shard_dataset(part, index, num_shards) for part in dataset.iterables]
+        )
+    return StridedDataset(dataset, index, num_shards)
+
+
+def skip_dataset(dataset, num_series: int):
+    """
+    Return a dataset returned by ``load_file_dataset`` that starts after the
+    first ``num_series`` series it yields over repeated passes, e.g. those
+    read before the checkpoint a run is resumed from. The position is split
+    evenly over shards created afterwards by ``shard_dataset``.
+
+    Window caches and files that are not in Arrow format are returned
+    unchanged, so they start again from the beginning.
+    """
+    if isinstance(dataset, (FilteredArrowFile, IndexedArrowDataset, SharedCorpusDataset)):
+        skipped = copy(dataset)
+        skipped.position = num_series
+        return skipped
+    if isinstance(dataset, Chain) and all(
+        isinstance(part, FilteredArrowFile) for part in dataset.iterables
+    ):
+        parts = list(dataset.iterables)
+        sizes = [part.num_series() for part in parts]
+        if sum(sizes) == 0:
+            return dataset
+        offset = num_series % sum(sizes)
+        index = 0
+        while offset >= sizes[index]:
+            offset -= sizes[index]
+            index += 1
+        # The parts are read in a loop, so rotating them continues the stream
+        return Chain(
+            [skip_dataset(parts[index], offset)] + parts[index + 1 :] + parts[:index]
+        )
+    return dataset
+
+
+def load_file_dataset(
+    data_path: Path,
+    min_length: int = 0,
+    max_missing_prop: float = 1.0,
+    random_access: bool = False,
+    seed: int = 0,
+    shared_corpus_dir: Optional[Path] = None,
+    data_fraction: float = 1.0,
+):
+    """
+    Load a training dataset, keeping only series that pass
+    ``has_enough_observations``, from a single Arrow file or from a shard
+    manifest (``.json``) written by ``getTrainingData.py --num-shards N``.
+    The shards of a manifest are chained in manifest order, so the manifest
+    behaves like a single file with respect to ``probability``.
+
+    If a statistics sidecar exists next to an Arrow file, ineligible series
+    are skipped without being decoded. A window cache directory written by
+    ``build_window_cache.py`` is loaded as a ``WindowCache``; its series were
+    already filtered when the windows were sampled.
+
+    With ``random_access``, Arrow files and manifests are loaded as an
+    ``IndexedArrowDataset`` that visits the series (of all shards of a
+    manifest) in a new random order on every pass, using ``seed``.
+
+    With ``shared_corpus_dir``, Arrow files and manifests are decoded once
+    per node into that directory (see ``load_shared_corpus``) and loaded as a
+    ``SharedCorpusDataset``.
+
+    With ``data_fraction`` below 1, only a deterministic subset of that
+    fraction of the series of every Arrow file is kept, selected up front
+    from the content hashes in the statistics sidecars (see
+    ``get_subset_mask``).
+    """
+    if is_window_cache(data_path):
+        assert data_fraction >= 1.0, "data_fraction is not supported for window caches"
+        return WindowCache(data_path)
+
+    if random_access or shared_corpus_dir is not None:
+        if data_path.suffix == ".json":
+            with open(data_path) as fp:
+                manifest = json.load(fp)
+            paths = [data_path.parent / shard["path"] for shard in manifest["shards"]]
+        else:
+            paths = [data_path]
+        assert all(
+            is_arrow_file(path) for path in paths
+        ), f"random access and shared corpora require Arrow files, got {data_path}"
+
+    if shared_corpus_dir is not None:
+        return SharedCorpusDataset(
+            load_shared_corpus(paths, shared_corpus_dir),
+            min_length=min_length,
+            max_missing_prop=max_missing_prop,
+            random_access=random_access,
+            seed=seed,
+            data_fraction=data_fraction,
+            source_paths=paths,
+        )
+
+    if random_access:
+        return IndexedArrowDataset(
+            paths,
+            min_length=min_length,
+            max_missing_prop=max_missing_prop,
+            seed=seed,
+            data_fraction=data_fraction,
+        )
+
+    if data_path.suffix == ".json":
+        with open(data_path) as fp:
+            manifest = json.load(fp)
+        return Chain(
+            [
+                load_file_dataset(
+                    data_path.parent / shard["path"],
+                    min_length=min_length,
+                    max_missing_prop=max_missing_prop,
+                    data_fraction=data_fraction,
+                )
+                for shard in manifest["shards"]
+            ]
+        )
+
+    if is_arrow_file(data_path):
+        return FilteredArrowFile(
+            data_path,
+            min_length=min_length,
+            max_missing_prop=max_missing_prop,
+            data_fraction=data_fraction,
+        )
+
+    assert data_fraction >= 1.0, f"data_fraction requires an Arrow file, got {data_path}"
+    return Filter(
+        partial(
+            has_enough_observations,
+            min_length=min_length,
+            max_missing_prop=max_missing_prop,
+        ),
+        FileDataset(path=data_path, freq="h"),
+    )
+
+
 def has_enough_observations(
     entry: dict, min_length: int = 0, max_missing_prop: float = 1.0
 ) -> bool:
@@ -244,39 +1236,93 @@ def has_enough_observations(
     return False
 
 
+def get_nbytes(element) -> int:
+    """
+    Approximate memory footprint of a dataset element, counting the
+    payload of (nested dicts of) tensors and arrays.
+    """
+    if isinstance(element, dict):
+        return sum(get_nbytes(value) for value in element.values())
+    if isinstance(element, torch.Tensor):
+        return element.element_size() * element.nelement()
+    if isinstance(element, np.ndarray):
+        return element.nbytes
+    return sys.getsizeof(element)
+
+
 class PseudoShuffledIterableDataset(IterableDataset):
     """
     Shuffle entries from an iterable by temporarily accumulating them
     in an intermediate buffer.
 
+    Entries are removed from the buffer by swapping them with the last
+    entry, so each removal is O(1) regardless of the buffer length, and
+    random indices are derived from uniform draws generated in bulk.
+
     Parameters
     ----------
     base_dataset
         The original iterable object, representing the dataset.
     shuffle_buffer_length
         Size of the buffer use to shuffle entries from the base dataset.
+    shuffle_buffer_bytes
+        Optional limit on the memory held by the buffer. Entries are
+        emitted as soon as either limit is reached.
     """
 
-    def __init__(self, base_dataset, shuffle_buffer_length: int = 100) -> None:
+    random_batch_size = 4096
+
+    def __init__(
+        self,
+        base_dataset,
+        shuffle_buffer_length: int = 100,
+        shuffle_buffer_bytes: Optional[int] = None,
+    ) -> None:
         super().__init__()
         self.base_dataset = base_dataset
         self.shuffle_buffer_length = shuffle_buffer_length
+        self.shuffle_buffer_bytes = shuffle_buffer_bytes
         self.generator = torch.Generator()
 
+    def _uniform_draws(self) -> Iterator[float]:
+        while True:
+            yield from torch.rand(
+                self.random_batch_size, generator=self.generator, dtype=torch.float64
+            ).tolist()
+
     def __iter__(self):
         shuffle_buffer = []
+        buffer_bytes = 0
+        uniform_draws = self._uniform_draws()
+
+        def pop_random():
+            # Uniform index into the current buffer, then swap-remove
+            idx = int(next(uniform_draws) * len(shuffle_buffer))
+            shuffle_buffer[idx], shuffle_buffer[-1] = (
+                shuffle_buffer[-1],
+                shuffle_buffer[idx],
+            )
+            return shuffle_buffer.pop()
 
         for element in self.base_dataset:
             shuffle_buffer.append(element)
-            if len(shuffle_buffer) >= self.shuffle_buffer_length:
-                idx = torch.randint(
-                    len(shuffle_buffer), size=(), generator=self.generator
+            if self.shuffle_buffer_bytes is not None:
+                buffer_bytes += get_nbytes(element)
+
+            while shuffle_buffer and (
+                len(shuffle_buffer) >= self.shuffle_buffer_length
+                or (
+                    self.shuffle_buffer_bytes is not None
+                    and buffer_bytes >= self.shuffle_buffer_bytes
                 )
-                yield shuffle_buffer.pop(idx)
+            ):
+                element = pop_random()
+                if self.shuffle_buffer_bytes is not None:
+                    buffer_bytes -= get_nbytes(element)
+                yield element
 
         while shuffle_buffer:
-            idx = torch.randint(len(shuffle_buffer), size=(), generator=self.generator)
-            yield shuffle_buffer.pop(idx)
+            yield pop_random()
 
 
 class ShuffleMixin:
@@ -285,8 +1331,14 @@ class ShuffleMixin:
     shuffling functionality.
     """
 
-    def shuffle(self, shuffle_buffer_length: int = 100):
-        return PseudoShuffledIterableDataset(self, shuffle_buffer_length)
+    def shuffle(
+        self,
+        shuffle_buffer_length: int = 100,
+        shuffle_buffer_bytes: Optional[int] = None,
+    ):
+        return PseudoShuffledIterableDataset(
+            self, shuffle_buffer_length, shuffle_buffer_bytes
+        )
 
 
 class ChronosDataset(IterableDataset, ShuffleMixin):
@@ -301,7 +1353,8 @@ class ChronosDataset(IterableDataset, ShuffleMixin):
     Parameters
     ----------
     datasets
-        Datasets containing the original time series data.
+        Datasets containing the original time series data, or ``WindowCache``
+        objects with pre-sampled training windows.
     probabilities
         In training mode, data will be sampled from each of the original datasets
         with these probabilities.
@@ -321,8 +1374,17 @@ class ChronosDataset(IterableDataset, ShuffleMixin):
         One of ``"training"``, ``"validation"``, or ``"test"``.
     np_dtype
         Numpy float data type.
+    vectorized
+        In training mode, turn windows into samples ``window_batch_size`` at a
+        time, injecting missing values and tokenizing with array operations,
+        and draw the datasets of ``mixture_schedule_length`` samples at once
+        (seq2seq models only). Missing values are then injected per window
+        rather than per series, so samples differ from the default path.
     """
 
+    window_batch_size = 256
+    mixture_schedule_length = 4096
+
     def __init__(
         self,
         datasets: list,
@@ -336,6 +1398,7 @@ class ChronosDataset(IterableDataset, ShuffleMixin):
         imputation_method: Optional[MissingValueImputation] = None,
         mode: str = "training",
         np_dtype=np.float32,
+        vectorized: bool = False,
     ) -> None:
         super().__init__()
 
@@ -354,6 +1417,16 @@ class ChronosDataset(IterableDataset, ShuffleMixin):
         self.imputation_method = imputation_method or LeavesMissingValues()
         self.mode = mode
         self.np_dtype = np_dtype
+        self.vectorized = vectorized and model_type == "seq2seq"
+
+        for dataset in datasets:
+            if isinstance(dataset, WindowCache):
+                # Cached windows are tokenized in batches, which does not
+                # implement the padding rearrangement of causal models
+                assert model_type == "seq2seq"
+                assert dataset.prediction_length == prediction_length
+                assert dataset.min_past == self.min_past
+                assert dataset.context_length >= context_length
 
     def preprocess_entry(self, entry: dict, mode: str) -> dict:
         entry = {f: entry[f] for f in ["start", "target"]}
@@ -365,7 +1438,7 @@ class ChronosDataset(IterableDataset, ShuffleMixin):
             # recommended to use an imputation method, e.g., LastValueImputation
             entry["target"] = self.imputation_method(entry["target"])
 
-        if mode == "training" and self.drop_prob > 0:
+        if mode == "training" and self.drop_prob > 0 and not self.vectorized:
             target = entry["target"].copy()
             drop_p = np.random.uniform(low=0.0, high=self.drop_prob)
             mask = np.random.choice(
@@ -401,15 +1474,65 @@ class ChronosDataset(IterableDataset, ShuffleMixin):
             dummy_value=np.nan,
         )
 
-    def create_training_data(self, data):
-        data = Cyclic(data)
-        split_transform = self._create_instance_splitter(
-            "training"
-        ) + FilterTransformation(
-            condition=lambda entry: (~np.isnan(entry["past_target"])).sum() > 0
-        )
-        data = split_transform.apply(data, is_train=True)
-        return data
+    def sample_training_windows(
+        self, data, cyclic: bool = True
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Sample training windows from every series, with the same semantics
+        (and the same draws from ``np.random``) as the ``InstanceSplitter``
+        with ``ExpectedNumInstanceSampler`` of earlier versions: window ends
+        lie in ``[min_past, len(target) - prediction_length]``, about one
+        window is drawn per series of average length, at least one per series,
+        and windows whose context is entirely missing are dropped.
+
+        For every series, yields an array of windows of ``context_length +
+        prediction_length`` values, with the context left-padded with
+        ``np.nan``, and the number of padded values of every window.
+        """
+        if cyclic:
+            data = Cyclic(data)
+        # The series is copied behind context_length NaNs, so that all windows
+        # are views into the buffer
+        padded = np.full(2 * self.context_length, np.nan, dtype=self.np_dtype)
+        num_series, total_length = 0, 0
+
+        for entry in data:
+            target = entry["target"]
+            low, high = self.min_past, len(target) - self.prediction_length
+            num_positions = high - low + 1
+            if num_positions <= 0:
+                continue
+
+            num_series += 1
+            total_length += num_positions
+            p = 1.0 / (total_length / num_series)
+            indices = np.flatnonzero(np.random.random_sample(num_positions) < p) + low
+            if len(indices) == 0:
+                indices = np.random.randint(low, high + 1, size=1)
+
+            end = self.context_length + len(target)
+            if len(padded) < end:
+                padded = np.full(2 * end, np.nan, dtype=self.np_dtype)
+            padded[self.context_length : end] = target
+            windows = sliding_window_view(
+                padded[:end], self.context_length + self.prediction_length
+            )[indices]
+
+            observed = ~np.isnan(windows[:, : self.context_length]).all(axis=1)
+            if observed.any():
+                pad_length = np.maximum(self.context_length - indices[observed], 0)
+                yield windows[observed], pad_length
+
+    def create_training_data(self, data, cyclic: bool = True):
+        for windows, pad_length in self.sample_training_windows(data, cyclic=cyclic):
+            for window, num_padded in zip(windows, pad_length):
+                past_is_pad = np.zeros(self.context_length, dtype=self.np_dtype)
+                past_is_pad[:num_padded] = 1
+                yield {
+                    "past_target": window[: self.context_length],
+                    "future_target": window[self.context_length :],
+                    "past_is_pad": past_is_pad,
+                }
 
     def create_test_data(self, data):
         data = self._create_instance_splitter("test").apply(data, is_train=False)
@@ -475,56 +1598,889 @@ class ChronosDataset(IterableDataset, ShuffleMixin):
             "labels": labels.squeeze(0),
         }
 
+    def create_cached_data(self, cache: WindowCache) -> Iterator:
+        """
+        Yield HuggingFace-format samples from pre-sampled windows. In training
+        mode the windows are visited in a new random order on every pass over
+        the cache, and missing values are injected as in ``preprocess_entry``,
+        one batch of windows at a time.
+        """
+        windows = cache.open()
+        rows = np.arange(cache.start, cache.stop)
+        if len(rows) == 0:
+            return
+        rng = np.random.default_rng(torch.initial_seed())
+
+        while True:
+            if self.mode == "training":
+                rows = rng.permutation(rows)
+            for start in range(0, len(rows), self.window_batch_size):
+                idx = np.sort(rows[start : start + self.window_batch_size])
+                batch = windows[idx]
+                if self.mode == "training":
+                    self.inject_missing_values(batch, rng)
+                yield from self.windows_to_hf_format(batch)
+            if self.mode != "training":
+                return
+
+    def create_batched_hf_data(self, data) -> Iterator[dict]:
+        """
+        Yield HuggingFace-format samples from the output of
+        ``sample_training_windows``, collecting ``window_batch_size`` windows
+        in a preallocated array and converting them together.
+        """
+        windows = np.empty(
+            (self.window_batch_size, self.context_length + self.prediction_length),
+            dtype=np.float32,
+        )
+        size = 0
+        for series_windows, _ in data:
+            while len(series_windows) > 0:
+                num_copied = min(len(series_windows), self.window_batch_size - size)
+                windows[size : size + num_copied] = series_windows[:num_copied]
+                series_windows = series_windows[num_copied:]
+                size += num_copied
+                if size == self.window_batch_size:
+                    yield from self.windows_to_hf_format(
+                        self.inject_missing_values(windows, np.random)
+                    )
+                    size = 0
+        if size > 0:
+            yield from self.windows_to_hf_format(
+                self.inject_missing_values(windows[:size], np.random)
+            )
+
+    def inject_missing_values(self, windows: np.ndarray, rng) -> np.ndarray:
+        """
+        Turn observations of every window into ``np.nan`` in place, with a
+        probability drawn uniformly from ``[0, drop_prob)`` for each window.
+        """
+        if self.drop_prob > 0:
+            drop_p = rng.uniform(0.0, self.drop_prob, size=(len(windows), 1))
+            windows[rng.random(windows.shape) < drop_p] = np.nan
+        return windows
+
+    def windows_to_hf_format(self, windows: np.ndarray) -> Iterator[dict]:
+        """
+        Batched ``to_hf_format`` for seq2seq models, for windows laid out as in
+        ``WindowCache``.
+        """
+        context_end = windows.shape[1] - self.prediction_length
+        past_target = torch.from_numpy(
+            windows[:, context_end - self.context_length : context_end]
+        )
+        future_target = torch.from_numpy(windows[:, context_end:])
+
+        input_ids, attention_mask, scale = self.tokenizer.context_input_transform(
+            past_target
+        )
+        labels, labels_mask = self.tokenizer.label_input_transform(future_target, scale)
+        labels[labels_mask == 0] = -100
+
+        for i in range(len(windows)):
+            yield {
+                "input_ids": input_ids[i],
+                "attention_mask": attention_mask[i],
+                "labels": labels[i],
+            }
+
     def __iter__(self) -> Iterator:
-        preprocessed_datasets = [
-            Map(
-                partial(self.preprocess_entry, mode=self.mode),
-                dataset,
+        # Every worker of every rank reads its own part of every dataset and
+        # mixes them with the full probabilities, so the mixture is the same
+        # on all workers and ranks.
+        rank, world_size = get_rank_and_world_size()
+        worker_info = get_worker_info()
+        worker_id, num_workers = (
+            (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        )
+        datasets = [
+            shard_dataset(
+                dataset, rank * num_workers + worker_id, world_size * num_workers
             )
             for dataset in self.datasets
         ]
 
-        if self.mode == "training":
-            iterables = [
-                self.create_training_data(dataset) for dataset in preprocessed_datasets
-            ]
-        elif self.mode == "test":
-            iterables = [
-                self.create_test_data(dataset) for dataset in preprocessed_datasets
-            ]
-        else:
-            iterables = [
-                self.create_validation_data(dataset)
-                for dataset in preprocessed_datasets
-            ]
-
-        worker_info = get_worker_info()
-        if worker_info is None:
-            probs = list(self.probabilities)
-        else:
-            worker_id = worker_info.id
-            num_workers = worker_info.num_workers
-            iterables = list(itertools.islice(iterables, worker_id, None, num_workers))
-            probs = list(
-                itertools.islice(self.probabilities, worker_id, None, num_workers)
+        create_data = {
+            "training": self.create_training_data,
+            "test": self.create_test_data,
+            "validation": self.create_validation_data,
+        }[self.mode]
+
+        iterables = []
+        for dataset in datasets:
+            if isinstance(dataset, WindowCache):
+                iterables.append(self.create_cached_data(dataset))
+                continue
+            preprocessed_dataset = Map(
+                partial(self.preprocess_entry, mode=self.mode),
+                dataset,
             )
+            if self.mode == "training" and self.vectorized:
+                iterables.append(
+                    self.create_batched_hf_data(
+                        self.sample_training_windows(preprocessed_dataset)
+                    )
+                )
+            else:
+                iterables.append(
+                    Map(self.to_hf_format, create_data(preprocessed_dataset))
+                )
 
+        probs = list(self.probabilities)
         probs = [prob / sum(probs) for prob in probs]
 
         iterators = list(map(iter, iterables))
         if self.mode == "training":
             while True:
-                idx = np.random.choice(range(len(iterators)), p=probs)
-                try:
-                    yield self.to_hf_format(next(iterators[idx]))
-                except StopIteration:
-                    probs[idx] = 0
-                    if sum(probs) == 0:
-                        return
-                    probs = [prob / sum(probs) for prob in probs]
+                if self.vectorized:
+                    # Draw the datasets of the next samples at once; the
+                    # schedule is drawn again when a dataset is exhausted
+                    schedule = np.random.choice(
+                        len(iterators), size=self.mixture_schedule_length, p=probs
+                    )
+                else:
+                    schedule = [np.random.choice(range(len(iterators)), p=probs)]
+                for idx in schedule:
+                    try:
+                        yield next(iterators[idx])
+                    except StopIteration:
+                        probs[idx] = 0
+                        if sum(probs) == 0:
+                            return
+                        probs = [prob / sum(probs) for prob in probs]
+                        break
         else:
-            for entry in itertools.chain(*iterators):
-                yield self.to_hf_format(entry)
+            yield from itertools.chain(*iterators)
+
+
+class ChronosTrainer(Trainer):
+    """
+    ``Trainer`` that, in multi-process training, hands the training dataset
+    to a plain ``DataLoader`` on every rank. ``ChronosDataset`` already
+    partitions the data by rank and worker; the default accelerate wrapping
+    would instead read the data on one rank and dispatch it, or let every
+    rank read everything and keep only its slice. Evaluation leaves the
+    random state of training untouched.
+    """
+
+    def get_train_dataloader(self) -> DataLoader:
+        if get_rank_and_world_size()[1] == 1:
+            return super().get_train_dataloader()
+
+        return DataLoader(
+            self.train_dataset,
+            batch_size=self._train_batch_size,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+
+    def evaluate(self, *args, **kwargs):
+        # Creating the evaluation DataLoader iterator draws a seed from the
+        # global torch RNG; forking it keeps dropout and data of training the
+        # same as in a run without validation
+        with torch.random.fork_rng(devices=range(torch.cuda.device_count())):
+            return super().evaluate(*args, **kwargs)
+
+
+class StepTimeCallback(TrainerCallback):
+    """
+    Decompose the wall-clock time of a training run into phases (imports,
+    model and dataset setup, ``Trainer`` initialization, first step, warm-up,
+    checkpointing, validation, steady state), and every optimizer step into
+    the time spent waiting for data and the time spent in forward, backward
+    and optimizer step. At the end of training, the phases are written to the
+    ``TrainingPhases`` table and per-logging-interval step times to the
+    ``StepTimes`` table of ``run_db``, for the ``TrainingRuns`` row ``run_id``.
+
+    Parameters
+    ----------
+    run_db
+        Path to the experiment database, e.g. ``Speedup.db``.
+    run_id
+        ``run_id`` of the run in the ``TrainingRuns`` table.
+    phases
+        Durations of the phases before training, in seconds.
+    warmup_steps
+        Steps excluded from the steady-state averages, which include dataloader
+        start-up, shuffle buffer warm-up and ``torch_compile`` compilation.
+    """
+
+    def __init__(
+        self, run_db: str, run_id: int, phases: Dict[str, float], warmup_steps: int = 10
+    ) -> None:
+        self.run_db = run_db
+        self.run_id = run_id
+        self.phases = dict(phases)
+        self.warmup_steps = warmup_steps
+        self.created = time.perf_counter()
+
+        self.step_start = self.last_step_end = None
+        self.checkpoint_s = self.eval_s = 0.0
+        # Sums over the current logging interval and over the steady state
+        self.interval = {"num_steps": 0, "data_wait_s": 0.0, "compute_s": 0.0}
+        self.steady = {"num_steps": 0, "data_wait_s": 0.0, "compute_s": 0.0}
+        self.step_times = []
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.train_begin = self.last_step_end = time.perf_counter()
+        # Steps are counted from the checkpoint when resuming
+        self.start_step = state.global_step
+        self.phases["trainer_init_s"] = self.train_begin - self.created
+        self.samples_per_step = (
+            args.train_batch_size * args.gradient_accumulation_steps * args.world_size
+        )
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self.step_start = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if torch.cuda.is_available():
+            # Kernels run asynchronously, wait for them to count them as compute
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        data_wait_s = self.step_start - self.last_step_end
+        compute_s = now - self.step_start
+        self.last_step_end = now
+
+        step = state.global_step - self.start_step
+        if step == 1:
+            self.phases["first_data_wait_s"] = data_wait_s
+            self.phases["first_compute_s"] = compute_s
+        if step == self.warmup_steps:
+            self.phases["warmup_s"] = now - self.train_begin
+        if step > self.warmup_steps:
+            for sums in (self.interval, self.steady):
+                sums["num_steps"] += 1
+                sums["data_wait_s"] += data_wait_s
+                sums["compute_s"] += compute_s
+
+        if state.global_step % args.logging_steps == 0 and self.interval["num_steps"]:
+            self.step_times.append((state.global_step, *self._means(self.interval)))
+            self.interval = {"num_steps": 0, "data_wait_s": 0.0, "compute_s": 0.0}
+
+    def on_save(self, args, state, control, **kwargs):
+        # Checkpoints are saved after on_step_end, keep them out of the data wait
+        now = time.perf_counter()
+        self.checkpoint_s += now - self.last_step_end
+        self.last_step_end = now
+
+    def on_evaluate(self, args, state, control, **kwargs):
+        # Same for evaluations, which run before checkpoints are saved
+        now = time.perf_counter()
+        self.eval_s += now - self.last_step_end
+        self.last_step_end = now
+
+    def _means(self, sums: Dict) -> tuple:
+        num_steps = sums["num_steps"]
+        data_wait_s = sums["data_wait_s"] / num_steps
+        compute_s = sums["compute_s"] / num_steps
+        return (
+            num_steps,
+            data_wait_s,
+            compute_s,
+            self.samples_per_step / (data_wait_s + compute_s),
+        )
+
+    def on_train_end(self, args, state, control, **kwargs):
+        if not is_main_process():
+            return
+        now = time.perf_counter()
+        phases = {
+            **self.phases,
+            "checkpoint_s": self.checkpoint_s,
+            **({"eval_s": self.eval_s} if self.eval_s else {}),
+            "train_s": now - self.train_begin,
+            "total_s": now - IMPORT_START,
+        }
+        if self.steady["num_steps"]:
+            (
+                phases["steady_steps"],
+                phases["steady_data_wait_s"],
+                phases["steady_compute_s"],
+                phases["steady_samples_per_s"],
+            ) = self._means(self.steady)
+
+        try:
+            connection = sqlite3.connect(self.run_db, timeout=30)
+            with connection:
+                connection.execute(
+                    f"INSERT OR REPLACE INTO TrainingPhases (run_id, {', '.join(phases)}) "
+                    f"VALUES (?{', ?' * len(phases)})",
+                    (self.run_id, *phases.values()),
+                )
+                connection.executemany(
+                    "INSERT INTO StepTimes (run_id, training_step, num_steps, "
+                    "data_wait_s, compute_s, samples_per_s) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(self.run_id, *row) for row in self.step_times],
+                )
+            connection.close()
+        except sqlite3.Error as e:
+            # Losing the timings should not fail a finished training run
+            logger.warning(f"Could not write step times to {self.run_db}: {e}")
+
+
+class WeightSnapshotCallback(TrainerCallback):
+    """
+    Save weights-only snapshots (``config.json`` with the chronos config,
+    ``model.safetensors`` and ``training_info.json``, as in
+    ``checkpoint-final``) to ``checkpoint-<step>`` every ``snapshot_steps``
+    steps. The weights are copied to CPU memory in the training loop and
+    written by a background thread; at most one snapshot is written at a
+    time. Steps at which the ``Trainer`` saves a full checkpoint, and the last
+    step, are skipped.
+
+    Parameters
+    ----------
+    model
+        The model being trained.
+    snapshot_steps
+        Interval of the snapshots, in optimizer steps.
+    training_config
+        Training config saved in ``training_info.json``.
+    """
+
+    def __init__(
+        self, model, snapshot_steps: int, training_config: Optional[Dict] = None
+    ) -> None:
+        self.model = model
+        self.snapshot_steps = snapshot_steps
+        self.training_config = training_config
+        self.writer = None
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if (
+            not is_main_process()
+            or state.global_step % self.snapshot_steps != 0
+            or state.global_step >= state.max_steps
+            or (args.save_steps and state.global_step % args.save_steps == 0)
+        ):
+            return
+
+        self.wait()
+        # Tensors that share memory (tied embeddings) share their copy too, so
+        # that save_pretrained stores them once, as in checkpoint-final
+        copies, state_dict = {}, {}
+        for name, tensor in self.model.state_dict().items():
+            key = (tensor.data_ptr(), tensor.dtype, tensor.shape)
+            if key not in copies:
+                copies[key] = tensor.detach().to("cpu", copy=True)
+            state_dict[name] = copies[key]
+        self.writer = threading.Thread(
+            target=self._write,
+            args=(Path(args.output_dir) / f"checkpoint-{state.global_step}", state_dict),
+        )
+        self.writer.start()
+
+    def _write(self, ckpt_path: Path, state_dict: Dict[str, torch.Tensor]):
+        # Written next to the final location and renamed, so that a snapshot
+        # interrupted by the end of the job is not picked up by evaluation
+        tmp_path = ckpt_path.with_name(ckpt_path.name + ".tmp")
+        try:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            self.model.save_pretrained(
+                tmp_path, state_dict=state_dict, safe_serialization=True
+            )
+            if self.training_config is not None:
+                save_training_info(tmp_path, training_config=self.training_config)
+            # A resumed run writes the snapshots after its checkpoint again
+            shutil.rmtree(ckpt_path, ignore_errors=True)
+            os.rename(tmp_path, ckpt_path)
+        except Exception as e:
+            # Losing a snapshot should not fail the training run
+            logger.warning(f"Could not save weight snapshot {ckpt_path}: {e}")
+
+    def wait(self):
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self.wait()
+
+
+# Config parameters that change what the token cross-entropy is measured on;
+# losses of runs that differ in them (e.g. in the number of bins) are not
+# comparable
+LOSS_DEFINING_PARAMS = ["n_tokens", "tokenizer_class", "tokenizer_kwargs"]
+
+
+def get_comparable_runs(connection: sqlite3.Connection, run_id: int) -> List[int]:
+    """
+    Return the other runs of the same scaling method as run ``run_id`` whose
+    configs have the same ``LOSS_DEFINING_PARAMS``, so that their learning
+    curves can be compared with that of the run.
+    """
+    runs = connection.execute(
+        """
+        SELECT r.run_id, c.config_json FROM TrainingRuns r
+        JOIN Configs c ON r.config_id = c.config_id
+        WHERE c.scaling_method_id = (
+            SELECT c2.scaling_method_id FROM TrainingRuns r2
+            JOIN Configs c2 ON r2.config_id = c2.config_id WHERE r2.run_id = ?
+        )
+        """,
+        (run_id,),
+    ).fetchall()
+
+    def loss_definition(config_json: str) -> list:
+        # Written with json.dumps by some experiments and as a Python literal
+        # with double quotes by others
+        try:
+            config = json.loads(config_json)
+        except ValueError:
+            config = ast.literal_eval(config_json)
+        return [config.get(param) for param in LOSS_DEFINING_PARAMS]
+
+    definitions = {other_id: loss_definition(config_json) for other_id, config_json in runs}
+    return [
+        other_id
+        for other_id, definition in definitions.items()
+        if other_id != run_id and definition == definitions.get(run_id)
+    ]
+
+
+class StoppingRule(abc.ABC):
+    """
+    Base class of the rules that end hopeless training runs early, based on
+    the learning curves in the ``LearningCurves`` table of the experiment
+    database, compared with those of the runs from ``get_comparable_runs``.
+    Rules only act after ``grace_steps`` steps.
+
+    Parameters
+    ----------
+    grace_steps
+        Steps before which a run is never stopped.
+    min_runs
+        Number of other runs the rule needs to compare against.
+    """
+
+    def __init__(self, grace_steps: int = 5_000, min_runs: int = 5) -> None:
+        self.grace_steps = grace_steps
+        self.min_runs = min_runs
+
+    @abc.abstractmethod
+    def should_stop(
+        self, connection: sqlite3.Connection, run_id: int, step: int, max_steps: int
+    ) -> Optional[str]:
+        """
+        Return the reason to stop run ``run_id`` at ``step``, or None to
+        continue it.
+        """
+
+
+class MedianStoppingRule(StoppingRule):
+    """
+    Stop a run if its best loss so far is worse than the median of the mean
+    losses of the other runs up to the same step (median stopping rule of
+    Google Vizier).
+    """
+
+    def should_stop(self, connection, run_id, step, max_steps):
+        comparable_runs = get_comparable_runs(connection, run_id)
+        if len(comparable_runs) < self.min_runs:
+            return None
+        (best_loss,) = connection.execute(
+            "SELECT MIN(loss) FROM LearningCurves WHERE run_id = ? AND training_step <= ?",
+            (run_id, step),
+        ).fetchone()
+        mean_losses = [
+            mean_loss
+            for (mean_loss,) in connection.execute(
+                f"""
+                SELECT AVG(loss) FROM LearningCurves
+                WHERE training_step <= ? AND run_id IN ({", ".join("?" * len(comparable_runs))})
+                GROUP BY run_id HAVING MAX(training_step) >= ?
+                """,
+                (step, *comparable_runs, step),
+            )
+            if mean_loss is not None
+        ]
+        if best_loss is None or len(mean_losses) < self.min_runs:
+            return None
+
+        median_loss = float(np.median(mean_losses))
+        if best_loss > median_loss:
+            return (
+                f"best loss {best_loss:.4f} is worse than the median {median_loss:.4f} "
+                f"of the mean losses of {len(mean_losses)} runs up to step {step}"
+            )
+        return None
+
+
+class CurveExtrapolationRule(StoppingRule):
+    """
+    Stop a run if its loss, extrapolated to ``max_steps``, is worse than the
+    median final loss of the other runs that finished. The second half of the
+    curve is fitted by a line in log(step); loss curves flatten out over
+    log(step), so the extrapolation is optimistic.
+    """
+
+    def should_stop(self, connection, run_id, step, max_steps):
+        comparable_runs = get_comparable_runs(connection, run_id)
+        if len(comparable_runs) < self.min_runs:
+            return None
+        curve = np.array(
+            connection.execute(
+                "SELECT training_step, loss FROM LearningCurves "
+                "WHERE run_id = ? AND training_step <= ? AND loss IS NOT NULL "
+                "ORDER BY training_step",
+                (run_id, step),
+            ).fetchall(),
+            dtype=float,
+        ).reshape(-1, 2)
+        final_losses = [
+            loss
+            for (loss,) in connection.execute(
+                f"""
+                SELECT lc.loss FROM LearningCurves lc JOIN (
+                    SELECT run_id, MAX(training_step) AS last_step FROM LearningCurves
+                    WHERE run_id IN ({", ".join("?" * len(comparable_runs))})
+                    GROUP BY run_id HAVING last_step >= ?
+                ) f ON lc.run_id = f.run_id AND lc.training_step = f.last_step
+                """,
+                (*comparable_runs, max_steps),
+            )
+            if loss is not None
+        ]
+        curve = curve[len(curve) // 2 :]
+        if len(curve) < 2 or len(final_losses) < self.min_runs:
+            return None
+
+        slope, intercept = np.polyfit(np.log(curve[:, 0]), curve[:, 1], deg=1)
+        extrapolated_loss = slope * np.log(max_steps) + intercept
+        median_loss = float(np.median(final_losses))
+        if extrapolated_loss > median_loss:
+            return (
+                f"loss extrapolated to step {max_steps} ({extrapolated_loss:.4f}) is worse "
+                f"than the median final loss {median_loss:.4f} of {len(final_losses)} runs"
+            )
+        return None
+
+
+STOPPING_RULES = {
+    "median": MedianStoppingRule,
+    "extrapolation": CurveExtrapolationRule,
+}
+
+
+class LearningCurveCallback(TrainerCallback):
+    """
+    Write the training loss of every logging step, and the eval loss if the
+    run is evaluated, to the ``LearningCurves`` table of ``run_db`` while
+    training, so that running configs can be compared with each other. With
+    a ``stopping_rule``, the rule is checked at every logging step, and a run
+    it stops (or whose loss is not finite) ends early; the step and reason
+    are written to the ``EarlyStops`` table. The callback does not change
+    the training of runs that are not stopped.
+
+    Parameters
+    ----------
+    run_db
+        Path to the experiment database, e.g. ``MF2.db``.
+    run_id
+        ``run_id`` of the run in the ``TrainingRuns`` table.
+    stopping_rule
+        Rule that decides whether to stop the run, or None to only record
+        the learning curve.
+    """
+
+    def __init__(
+        self, run_db: str, run_id: int, stopping_rule: Optional[StoppingRule] = None
+    ) -> None:
+        self.run_db = run_db
+        self.run_id = run_id
+        self.stopping_rule = stopping_rule
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        logs = logs or {}
+        metric = next((key for key in ["loss", "eval_loss"] if key in logs), None)
+        if metric is None:
+            return
+
+        reason = None
+        if is_main_process():
+            reason = self._record(state, metric, logs[metric])
+        if metric == "loss" and dist.is_available() and dist.is_initialized():
+            # All ranks have to stop together
+            reasons = [reason]
+            dist.broadcast_object_list(reasons, src=0)
+            reason = reasons[0]
+        if reason is not None:
+            log_on_main(f"Stopping early at step {state.global_step}: {reason}", logger)
+            control.should_training_stop = True
+
+    def _record(self, state, metric: str, value: float) -> Optional[str]:
+        step = state.global_step
+        reason = None
+        try:
+            connection = sqlite3.connect(self.run_db, timeout=30)
+            with connection:
+                # Steps of a resumed run after its checkpoint are written again
+                connection.execute(
+                    f"INSERT INTO LearningCurves (run_id, training_step, {metric}) "
+                    f"VALUES (?, ?, ?) ON CONFLICT (run_id, training_step) "
+                    f"DO UPDATE SET {metric} = excluded.{metric}",
+                    (self.run_id, step, value),
+                )
+            if (
+                metric == "loss"
+                and self.stopping_rule is not None
+                and step >= self.stopping_rule.grace_steps
+                and step < state.max_steps
+            ):
+                if not np.isfinite(value):
+                    reason = f"loss is {value}"
+                else:
+                    reason = self.stopping_rule.should_stop(
+                        connection, self.run_id, step, state.max_steps
+                    )
+            if reason is not None:
+                with connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO EarlyStops "
+                        "(run_id, training_step, stopping_rule, reason) VALUES (?, ?, ?, ?)",
+                        (
+                            self.run_id,
+                            step,
+                            type(self.stopping_rule).__name__,
+                            reason,
+                        ),
+                    )
+            connection.close()
+        except sqlite3.Error as e:
+            # The run continues without its learning curve
+            logger.warning(f"Could not write the learning curve to {self.run_db}: {e}")
+            return None
+        return reason
+
+
+def create_train_dataset(
+    training_data_paths: List[str],
+    probability: List[float],
+    chronos_config: ChronosConfig,
+    min_past: int,
+    max_missing_prop: float,
+    random_access: bool = False,
+    shared_corpus_dir: Optional[str] = None,
+    seed: int = 0,
+    data_fraction: float = 1.0,
+    vectorized: bool = False,
+    skip_samples: int = 0,
+) -> ChronosDataset:
+    """
+    Load the training files and wrap them in the training ``ChronosDataset``
+    used by ``main``, before shuffling. With ``skip_samples``, e.g. the
+    samples read before the checkpoint a run is resumed from, every file
+    starts after its share of them according to ``probability`` (see
+    ``skip_dataset``); a training sample is drawn from about one series.
+    """
+    train_datasets = [
+        load_file_dataset(
+            Path(data_path),
+            min_length=min_past + chronos_config.prediction_length,
+            max_missing_prop=max_missing_prop,
+            random_access=random_access,
+            seed=seed,
+            shared_corpus_dir=(
+                Path(shared_corpus_dir) if shared_corpus_dir is not None else None
+            ),
+            data_fraction=data_fraction,
+        )
+        for data_path in training_data_paths
+    ]
+    if skip_samples > 0:
+        train_datasets = [
+            skip_dataset(dataset, int(skip_samples * prob / sum(probability)))
+            for dataset, prob in zip(train_datasets, probability)
+        ]
+
+    return ChronosDataset(
+        datasets=train_datasets,
+        probabilities=probability,
+        tokenizer=chronos_config.create_tokenizer(),
+        context_length=chronos_config.context_length,
+        prediction_length=chronos_config.prediction_length,
+        min_past=min_past,
+        model_type=chronos_config.model_type,
+        imputation_method=(
+            LastValueImputation() if chronos_config.model_type == "causal" else None
+        ),
+        mode="training",
+        vectorized=vectorized,
+    )
+
+
+def get_validation_cache_path(
+    paths: List[Path], chronos_config: ChronosConfig, min_past: int, **kwargs
+) -> Path:
+    """
+    Directory of the tokenized validation windows of the given files, next to
+    the first one. The name depends on the location, size and modification
+    time of the files, the window geometry and the tokenizer, so every config
+    with the same geometry and tokenizer reuses it.
+    """
+    key = json.dumps(
+        {
+            "paths": [
+                [str(path.resolve()), path.stat().st_size, path.stat().st_mtime_ns]
+                for path in paths
+            ],
+            "chronos_config": {
+                field: getattr(chronos_config, field)
+                for field in [
+                    "tokenizer_class",
+                    "tokenizer_kwargs",
+                    "n_tokens",
+                    "n_special_tokens",
+                    "pad_token_id",
+                    "eos_token_id",
+                    "use_eos_token",
+                    "model_type",
+                    "context_length",
+                    "prediction_length",
+                ]
+            },
+            "min_past": min_past,
+            **kwargs,
+        },
+        sort_keys=True,
+    )
+    return paths[0].with_name(
+        f"{paths[0].stem}.validation-{hashlib.sha1(key.encode()).hexdigest()[:16]}"
+    )
+
+
+class ValidationCache(Dataset):
+    """
+    Tokenized validation samples (``input_ids.npy``, ``attention_mask.npy``
+    and ``labels.npy``) written by ``load_validation_dataset``, read through
+    memory maps.
+    """
+
+    fields = ["input_ids", "attention_mask", "labels"]
+
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+        self.path = path
+        self.arrays = {
+            field: np.load(path / f"{field}.npy", mmap_mode="r")
+            for field in self.fields
+        }
+
+    def __len__(self) -> int:
+        return len(self.arrays["input_ids"])
+
+    def __getitem__(self, idx: int) -> dict:
+        return {
+            field: torch.from_numpy(np.array(array[idx]))
+            for field, array in self.arrays.items()
+        }
+
+
+def create_validation_cache(
+    paths: List[Path],
+    chronos_config: ChronosConfig,
+    min_past: int,
+    max_missing_prop: float,
+    max_windows: int,
+    cache_path: Path,
+):
+    """
+    Tokenize the last window of every series of the given files (at most
+    ``max_windows`` in total, split evenly over the files, but at least one
+    per file) with the
+    validation mode of ``ChronosDataset``, and save the samples as arrays in
+    a temporary directory that is renamed to ``cache_path`` once complete.
+    """
+    dataset = ChronosDataset(
+        datasets=[
+            load_file_dataset(
+                path,
+                min_length=min_past + chronos_config.prediction_length,
+                max_missing_prop=max_missing_prop,
+            )
+            for path in paths
+        ],
+        probabilities=[1.0 / len(paths)] * len(paths),
+        tokenizer=chronos_config.create_tokenizer(),
+        context_length=chronos_config.context_length,
+        prediction_length=chronos_config.prediction_length,
+        min_past=min_past,
+        model_type=chronos_config.model_type,
+        imputation_method=(
+            LastValueImputation() if chronos_config.model_type == "causal" else None
+        ),
+        mode="validation",
+    )
+    # Iterated here instead of through ChronosDataset.__iter__, which would
+    # only read the part of the data of this rank
+    samples = list(
+        itertools.chain.from_iterable(
+            itertools.islice(
+                Map(
+                    dataset.to_hf_format,
+                    dataset.create_validation_data(
+                        Map(partial(dataset.preprocess_entry, mode="validation"), data)
+                    ),
+                ),
+                max(max_windows // len(paths), 1),
+            )
+            for data in dataset.datasets
+        )
+    )
+    assert len(samples) > 0, f"No series in {paths} are long enough for validation"
+
+    tmp_path = cache_path.with_name(f"{cache_path.name}.tmp{os.getpid()}")
+    tmp_path.mkdir(parents=True)
+    for field in ValidationCache.fields:
+        np.save(
+            tmp_path / f"{field}.npy",
+            torch.stack([sample[field] for sample in samples]).numpy(),
+        )
+    with open(tmp_path / "validation.json", "w") as fp:
+        json.dump(
+            {
+                "paths": [str(path) for path in paths],
+                "chronos_config": chronos_config.__dict__,
+                "min_past": min_past,
+                "max_missing_prop": max_missing_prop,
+                "num_windows": len(samples),
+            },
+            fp,
+            indent=2,
+        )
+    os.rename(tmp_path, cache_path)
+
+
+def load_validation_dataset(
+    validation_data_paths: List[str],
+    chronos_config: ChronosConfig,
+    min_past: int,
+    max_missing_prop: float,
+    max_windows: int = 10_000,
+) -> ValidationCache:
+    """
+    Load the tokenized validation samples of the given held-out files,
+    creating them first if no run with the same window geometry and
+    tokenizer has done so yet. Concurrent callers wait for the creating
+    process.
+    """
+    paths = [Path(path) for path in validation_data_paths]
+    cache_path = get_validation_cache_path(
+        paths,
+        chronos_config,
+        min_past,
+        max_missing_prop=max_missing_prop,
+        max_windows=max_windows,
+    )
+    with open(cache_path.with_name(f"{cache_path.name}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not (cache_path / "validation.json").exists():
+            create_validation_cache(
+                paths, chronos_config, min_past, max_missing_prop, max_windows, cache_path
+            )
+    return ValidationCache(cache_path)
 
 
 #modified main fúnction to implement additional hyperparameter
@@ -543,6 +2499,20 @@ def main(
     learning_rate: float = 1e-3,
     optim: str = "adamw_torch_fused",
     shuffle_buffer_length: int = 100,
+    shuffle_buffer_bytes: Optional[int] = None,
+    # Read training series in a new global random order on every pass instead of
+    # shuffling samples in a buffer, requires Arrow files
+    random_access: bool = False,
+    # Node-local directory, e.g. /dev/shm/chronos, in which training files are
+    # decoded once and shared by all training jobs on the node
+    shared_corpus_dir: Optional[str] = None,
+    # Train on a deterministic subset of this fraction of the series of every
+    # training file, selected by content hash (requires the statistics sidecars)
+    data_fraction: float = 1.0,
+    # Build training samples in batches of windows with array operations
+    # (seq2seq only); faster, but missing values are injected per window
+    # instead of per series, so samples differ from the default path
+    vectorized: bool = False,
     gradient_accumulation_steps: int = 2,
     model_id: str = "google/t5-efficient-tiny",
     model_type: str = "seq2seq",
@@ -569,12 +2539,39 @@ def main(
     lr_scheduler_type: str = "linear",
     warmup_ratio: float = 0.0,
     dataloader_num_workers: int = 1,
+    ddp_backend: Optional[str] = None,
     max_missing_prop: float = 0.9,
     num_samples: int = 20,
     temperature: float = 1.0,
     top_k: int = 50,
     top_p: float = 1.0,
     seed: Optional[int] = None,
+    # Save weights-only snapshots every snapshot_steps steps, written in the
+    # background; save_steps then only sets the interval of full checkpoints
+    # (with optimizer state) to resume from
+    snapshot_steps: Optional[int] = None,
+    # Held-out files: the last window of each series is tokenized once, cached
+    # next to them and evaluated (teacher-forced token cross-entropy, logged as
+    # eval_loss) every validation_steps steps
+    validation_data_paths: Optional[str] = None,
+    validation_steps: int = 5_000,
+    max_validation_windows: int = 10_000,
+    # Rule ("median" or "extrapolation") that ends runs early whose learning
+    # curve is clearly worse than those of the other runs in run_db
+    stopping_rule: Optional[str] = None,
+    stopping_grace_steps: int = 5_000,
+    # Continue the last run in output_dir from its latest complete checkpoint
+    # if it did not finish, e.g. because the job hit its time limit
+    resume: bool = True,
+    # Experiment database and TrainingRuns row to record the step time
+    # decomposition and the learning curve in
+    run_db: Optional[str] = None,
+    run_id: Optional[int] = None,
+    # Trained checkpoint of a smaller config (fewer layers, smaller d_model or
+    # d_ff) to grow the model from, and the steps to train it for instead of
+    # max_steps
+    warm_start_from: Optional[str] = None,
+    warm_start_max_steps: Optional[int] = None,
 ):
     if tf32 and not (
         torch.cuda.is_available() and torch.cuda.get_device_capability()[0] >= 8
@@ -607,24 +2604,44 @@ def main(
     assert isinstance(probability, list)
 
     assert len(training_data_paths) == len(probability)
+    assert 0.0 < data_fraction <= 1.0
 
-    if dataloader_num_workers > len(training_data_paths):
-        log_on_main(
-            f"Setting the number of data loader workers to {len(training_data_paths)}, "
-            f"instead of {dataloader_num_workers}.",
-            logger,
-        )
-        dataloader_num_workers = len(training_data_paths)
+    if warm_start_from is not None and warm_start_max_steps is not None:
+        # A model grown from a trained smaller one needs fewer steps
+        max_steps = warm_start_max_steps
 
     if isinstance(tokenizer_kwargs, str):
         tokenizer_kwargs = ast.literal_eval(tokenizer_kwargs)
     assert isinstance(tokenizer_kwargs, dict)
 
     assert model_type in ["seq2seq", "causal"]
+    assert stopping_rule is None or (
+        stopping_rule in STOPPING_RULES and run_db is not None and run_id is not None
+    ), "stopping_rule must be one of STOPPING_RULES and needs run_db and run_id"
 
-    output_dir = get_next_path("run", base_dir=output_dir, file_type="")
+    if (
+        ddp_backend is None
+        and dist.is_torchelastic_launched()
+        and not torch.cuda.is_available()
+    ):
+        # Multi-process training on CPU, e.g. torchrun --nproc-per-node 4
+        ddp_backend = "gloo"
+
+    resume_checkpoint = None
+    interrupted_run = get_interrupted_run(output_dir) if resume else None
+    if interrupted_run is not None:
+        # Continue in the same run directory, from scratch if the run was
+        # interrupted before its first checkpoint
+        output_dir = interrupted_run
+        resume_checkpoint = get_last_checkpoint(interrupted_run)
+    else:
+        output_dir = get_next_path("run", base_dir=output_dir, file_type="")
 
     log_on_main(f"Logging dir: {output_dir}", logger)
+    resume_step = 0
+    if resume_checkpoint is not None:
+        resume_step = int(resume_checkpoint.name.replace("checkpoint-", ""))
+        log_on_main(f"Resuming from {resume_checkpoint}", logger)
     log_on_main(
         f"Loading and filtering {len(training_data_paths)} datasets "
         f"for training: {training_data_paths}",
@@ -636,19 +2653,9 @@ def main(
         logger,
     )
 
-    train_datasets = [
-        Filter(
-            partial(
-                has_enough_observations,
-                min_length=min_past + prediction_length,
-                max_missing_prop=max_missing_prop,
-            ),
-            FileDataset(path=Path(data_path), freq="h"),
-        )
-        for data_path in training_data_paths
-    ]
-
     log_on_main("Initializing model", logger)
+    phases = {"import_s": IMPORT_END - IMPORT_START}
+    phase_start = time.perf_counter()
 
     model = load_model(
         model_id=model_id,
@@ -666,6 +2673,7 @@ def main(
         num_layers = num_layers,
         num_heads = num_heads,
         d_ff = d_ff,
+        warm_start_from=warm_start_from,
     )
 
     chronos_config = ChronosConfig(
@@ -687,18 +2695,51 @@ def main(
 
     # Add extra items to model config so that it's saved in the ckpt
     model.config.chronos_config = chronos_config.__dict__
+    phases["model_load_s"] = time.perf_counter() - phase_start
+    phase_start = time.perf_counter()
 
-    shuffled_train_dataset = ChronosDataset(
-        datasets=train_datasets,
-        probabilities=probability,
-        tokenizer=chronos_config.create_tokenizer(),
-        context_length=context_length,
-        prediction_length=prediction_length,
+    train_dataset = create_train_dataset(
+        training_data_paths=training_data_paths,
+        probability=probability,
+        chronos_config=chronos_config,
         min_past=min_past,
-        model_type=model_type,
-        imputation_method=LastValueImputation() if model_type == "causal" else None,
-        mode="training",
-    ).shuffle(shuffle_buffer_length=shuffle_buffer_length)
+        max_missing_prop=max_missing_prop,
+        random_access=random_access,
+        shared_corpus_dir=shared_corpus_dir,
+        seed=seed,
+        data_fraction=data_fraction,
+        vectorized=vectorized,
+        # A resumed run continues after the series read up to its checkpoint
+        skip_samples=resume_step
+        * per_device_train_batch_size
+        * gradient_accumulation_steps
+        * get_rank_and_world_size()[1],
+    )
+    validation_dataset = None
+    if validation_data_paths is not None:
+        if isinstance(validation_data_paths, str):
+            validation_data_paths = ast.literal_eval(validation_data_paths)
+        assert isinstance(validation_data_paths, list)
+        validation_dataset = load_validation_dataset(
+            validation_data_paths,
+            chronos_config=chronos_config,
+            min_past=min_past,
+            max_missing_prop=max_missing_prop,
+            max_windows=max_validation_windows,
+        )
+        log_on_main(
+            f"Validating on {len(validation_dataset)} windows from {validation_dataset.path}",
+            logger,
+        )
+    phases["dataset_s"] = time.perf_counter() - phase_start
+
+    if random_access:
+        shuffled_train_dataset = train_dataset
+    else:
+        shuffled_train_dataset = train_dataset.shuffle(
+            shuffle_buffer_length=shuffle_buffer_length,
+            shuffle_buffer_bytes=shuffle_buffer_bytes,
+        )
 
     # Define training args
     training_args = TrainingArguments(
@@ -713,25 +2754,63 @@ def main(
         logging_steps=log_steps,
         save_strategy="steps",
         save_steps=save_steps,
+        eval_strategy="steps" if validation_dataset is not None else "no",
+        eval_steps=validation_steps,
+        per_device_eval_batch_size=per_device_train_batch_size,
+        prediction_loss_only=True,
         report_to=["tensorboard"],
         max_steps=max_steps,
         gradient_accumulation_steps=gradient_accumulation_steps,
         dataloader_num_workers=dataloader_num_workers,
+        ddp_backend=ddp_backend,
         tf32=tf32,  # remove this if not using Ampere GPUs (e.g., A100)
         torch_compile=torch_compile,
         ddp_find_unused_parameters=False,
         remove_unused_columns=False,
+        # Replaying the data stream up to the checkpoint would take as long as
+        # reading it in the first place; instead the datasets of a resumed run
+        # start after the series read up to the checkpoint (skip_samples)
+        ignore_data_skip=True,
     )
 
     # Create Trainer instance
-    trainer = Trainer(
+    callbacks = []
+    if snapshot_steps is not None:
+        # Before StepTimeCallback, so that the copy of the weights is not
+        # counted as waiting for data
+        callbacks.append(
+            WeightSnapshotCallback(
+                model, snapshot_steps, training_config=raw_training_config
+            )
+        )
+    if run_db is not None and run_id is not None:
+        callbacks.append(StepTimeCallback(run_db, run_id, phases))
+        callbacks.append(
+            LearningCurveCallback(
+                run_db,
+                run_id,
+                stopping_rule=(
+                    STOPPING_RULES[stopping_rule](grace_steps=stopping_grace_steps)
+                    if stopping_rule is not None
+                    else None
+                ),
+            )
+        )
+
+    trainer = ChronosTrainer(
         model=model,
         args=training_args,
         train_dataset=shuffled_train_dataset,
+        eval_dataset=validation_dataset,
+        callbacks=callbacks,
     )
     log_on_main("Training", logger)
 
-    trainer.train()
+    trainer.train(
+        resume_from_checkpoint=(
+            str(resume_checkpoint) if resume_checkpoint is not None else None
+        )
+    )
 
     if is_main_process():
         model.save_pretrained(output_dir / "checkpoint-final")
@@ -742,6 +2821,5 @@ def main(
 
 if __name__ == "__main__":
     logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    logger = logging.getLogger(__file__)
     logger.setLevel(logging.INFO)
     app()
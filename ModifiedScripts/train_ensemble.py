@@ -0,0 +1,260 @@
+"""
+Seed ensembles: N copies of the model of one training config, each
+initialized with its own seed and optionally trained with its own learning
+rate, are stacked with ``torch.func.stack_module_state`` and trained on the
+same batches with one ``vmap``-ed forward and backward pass per step. For
+small models this keeps the CPU or GPU about N times busier than N separate
+``train.py`` jobs, e.g. to estimate the variance across seeds of an
+architecture of ``headsConfigs.py`` or ``layersConfigs.py``.
+
+Every member is saved as an independent run: its own ``run-N`` directory in
+the ``output_dir`` of the config, with ``checkpoint-<step>`` (at
+``save_steps`` and ``snapshot_steps``, weights only) and ``checkpoint-final``
+as written by ``train.py``, and its seed and learning rate in
+``training_info.json``. The members share the data stream (seeded with the
+first seed), so the ensemble measures the variance due to initialization and
+dropout. ``torch_compile`` is not applied to the stacked model.
+
+Usage: python train_ensemble.py --config heads.yaml --seeds 1 --seeds 2 \\
+    --seeds 3 [--learning-rates 1e-3 ...] [--run-db Heads.db --run-ids 1 ...]
+"""
+
+import copy
+import logging
+import math
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import torch
+import transformers
+import typer
+from torch.func import functional_call, stack_module_state, vmap
+
+import train
+import train_multi
+from train import get_next_path, save_training_info
+from train_multi import (
+    create_dataloader,
+    create_model,
+    get_chronos_config,
+    get_device,
+    get_learning_curve,
+    is_checkpoint_step,
+    load_config,
+    log_learning_curve,
+    log_on_main,
+)
+
+app = typer.Typer(pretty_exceptions_enable=False)
+
+
+class StackedAdamW(torch.optim.Optimizer):
+    """
+    AdamW (without weight decay, as used by the ``Trainer``) for parameters
+    stacked along a leading member dimension, where the learning rate of
+    every member is the learning rate of the group, set by the LR scheduler,
+    times the member's entry of ``lr_scales``.
+
+    Parameters
+    ----------
+    params
+        Stacked parameters.
+    lr_scales
+        Learning rate of every member relative to ``lr``, of shape
+        ``(num_members,)``.
+    lr
+        Learning rate.
+    betas
+        Coefficients of the running averages of the gradient and its square.
+    eps
+        Term added to the denominator for numerical stability.
+    """
+
+    def __init__(
+        self,
+        params,
+        lr_scales: torch.Tensor,
+        lr: float = 1e-3,
+        betas=(0.9, 0.999),
+        eps: float = 1e-8,
+    ) -> None:
+        super().__init__(params, dict(lr=lr, betas=betas, eps=eps))
+        self.lr_scales = lr_scales
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        for group in self.param_groups:
+            beta1, beta2 = group["betas"]
+            for p in group["params"]:
+                if p.grad is None:
+                    continue
+                state = self.state[p]
+                if not state:
+                    state["step"] = 0
+                    state["exp_avg"] = torch.zeros_like(p)
+                    state["exp_avg_sq"] = torch.zeros_like(p)
+                state["step"] += 1
+                exp_avg, exp_avg_sq = state["exp_avg"], state["exp_avg_sq"]
+                exp_avg.lerp_(p.grad, 1 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(p.grad, p.grad, value=1 - beta2)
+
+                bias_correction1 = 1 - beta1 ** state["step"]
+                bias_correction2 = 1 - beta2 ** state["step"]
+                denom = (exp_avg_sq.sqrt() / math.sqrt(bias_correction2)).add_(
+                    group["eps"]
+                )
+                step_size = (group["lr"] / bias_correction1) * self.lr_scales.view(
+                    -1, *([1] * (p.dim() - 1))
+                )
+                p.sub_(step_size * exp_avg / denom)
+
+
+def clip_grad_norm_per_member(params: List[torch.Tensor], max_norm: float):
+    """
+    Clip the gradients of every member of stacked parameters to a total norm
+    of ``max_norm``, as ``torch.nn.utils.clip_grad_norm_`` does for a model.
+    """
+    grads = [p.grad for p in params if p.grad is not None]
+    norms = torch.stack(
+        [grad.flatten(1).pow(2).sum(dim=1) for grad in grads]
+    ).sum(dim=0).sqrt()
+    clip_coef = (max_norm / (norms + 1e-6)).clamp(max=1.0)
+    for grad in grads:
+        grad.mul_(clip_coef.view(-1, *([1] * (grad.dim() - 1))))
+
+
+@app.command()
+def main(
+    config: str = typer.Option(...),
+    seeds: List[int] = typer.Option(...),
+    learning_rates: Optional[List[float]] = typer.Option(None),
+    run_db: Optional[str] = None,
+    run_ids: Optional[List[int]] = typer.Option(None),
+):
+    config = load_config(config)
+    learning_rates = learning_rates or [config["learning_rate"]] * len(seeds)
+    assert len(learning_rates) == len(seeds), "one learning rate per seed"
+    assert not run_ids or len(run_ids) == len(seeds), "one run ID per seed"
+    assert train.get_rank_and_world_size()[1] == 1, "ensembles use one process"
+
+    device = get_device(config)
+    chronos_config = get_chronos_config(config)
+    member_configs = [
+        {**config, "seed": seed, "learning_rate": learning_rate}
+        for seed, learning_rate in zip(seeds, learning_rates)
+    ]
+
+    log_on_main(f"Training an ensemble of {len(seeds)} members")
+    models = [
+        # The fused attention kernels can't differentiate the T5 position
+        # bias, which is passed to them as attention mask, under vmap
+        create_model(member_config, chronos_config, attn_implementation="eager")
+        for member_config in member_configs
+    ]
+    for model in models:
+        model.to(device)
+        model.train()
+    params, buffers = stack_module_state(models)
+    # The first model is kept to save the members, a copy without storage is
+    # called with their stacked parameters
+    template = models[0]
+    stateless_model = copy.deepcopy(template).to("meta")
+    del models
+
+    def compute_loss(params, buffers, batch):
+        return functional_call(stateless_model, (params, buffers), kwargs=batch).loss
+
+    compute_losses = vmap(compute_loss, in_dims=(0, 0, None), randomness="different")
+
+    optimizer = StackedAdamW(
+        params.values(),
+        lr_scales=torch.tensor(learning_rates, device=device) / learning_rates[0],
+        lr=learning_rates[0],
+    )
+    scheduler = transformers.get_scheduler(
+        config["lr_scheduler_type"],
+        optimizer,
+        num_warmup_steps=math.ceil(config["warmup_ratio"] * config["max_steps"]),
+        num_training_steps=config["max_steps"],
+    )
+
+    output_dirs = []
+    for _ in seeds:
+        output_dirs.append(
+            get_next_path("run", base_dir=Path(config["output_dir"]), file_type="")
+        )
+        output_dirs[-1].mkdir(parents=True)
+        log_on_main(f"Logging dir: {output_dirs[-1]}")
+    learning_curves = [
+        get_learning_curve(config, run_db, run_ids[i] if run_ids else None)
+        for i in range(len(seeds))
+    ]
+
+    def save(member: int, name: str):
+        # Tied embeddings appear once in params, their aliases follow them
+        template.load_state_dict(
+            {key: value[member] for key, value in {**params, **buffers}.items()},
+            strict=False,
+        )
+        template.save_pretrained(output_dirs[member] / name)
+        save_training_info(
+            output_dirs[member] / name, training_config=member_configs[member]
+        )
+
+    dataloader = create_dataloader(member_configs[0], chronos_config, device)
+
+    log_on_main("Training")
+    start_time = time.perf_counter()
+    step = 0
+    running_loss, running_steps = 0.0, 0
+    stopped = [False] * len(seeds)
+    for micro_step, batch in enumerate(dataloader, start=1):
+        batch = {key: value.to(device) for key, value in batch.items()}
+        losses = compute_losses(params, buffers, batch)
+        losses = losses / config["gradient_accumulation_steps"]
+        losses.sum().backward()
+        running_loss += losses.detach()
+        if micro_step % config["gradient_accumulation_steps"] != 0:
+            continue
+
+        clip_grad_norm_per_member(list(params.values()), 1.0)
+        optimizer.step()
+        scheduler.step()
+        optimizer.zero_grad(set_to_none=True)
+        step += 1
+        running_steps += 1
+
+        if step % config["log_steps"] == 0:
+            member_losses = (running_loss / running_steps).tolist()
+            running_loss, running_steps = 0.0, 0
+            log_on_main(f"step {step}, losses {[round(l, 4) for l in member_losses]}")
+            for member, loss in enumerate(member_losses):
+                if not stopped[member] and log_learning_curve(
+                    learning_curves[member], step, config["max_steps"], loss
+                ):
+                    # A stopped member is frozen, the others continue
+                    stopped[member] = True
+                    optimizer.lr_scales[member] = 0.0
+                    save(member, "checkpoint-final")
+
+        if step >= config["max_steps"] or all(stopped):
+            break
+        if is_checkpoint_step(config, step):
+            for member in range(len(seeds)):
+                if not stopped[member]:
+                    save(member, f"checkpoint-{step}")
+
+    for member in range(len(seeds)):
+        if not stopped[member]:
+            save(member, "checkpoint-final")
+    log_on_main(
+        f"Trained {len(seeds)} members in {time.perf_counter() - start_time:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    train.logger.setLevel(logging.INFO)
+    train_multi.logger.setLevel(logging.INFO)
+    app()
@@ -0,0 +1,427 @@
+"""
+Co-training of several small models in one process: one training
+``ChronosDataset`` stream, built as in ``train.py``, feeds the same batches
+to K independent models, each with its own optimizer, learning rate
+schedule, checkpoints and ``run-N`` directory in its ``output_dir``. For
+configs that only use a fraction of a node (e.g. the small SpeedupExperiment
+configs), this pays for the imports, data decoding and shuffle buffer
+warm-up once instead of once per model.
+
+Every config is a YAML file with the parameters of ``train.py``; they have to
+agree on everything that determines the batches (``SHARED_PARAMS``).
+Architecture, initialization seed, learning rate, schedule, ``max_steps``
+and checkpoint intervals may differ; a model that reaches its ``max_steps``
+saves ``checkpoint-final`` and drops out while the others continue. The
+checkpoints at ``save_steps`` and ``snapshot_steps`` hold the weights only
+(as ``checkpoint-final``), so co-trained runs are not resumed from them.
+
+Usage: python train_multi.py --configs a.yaml --configs b.yaml \\
+    [--run-db Speedup.db --run-ids 1 --run-ids 2]
+"""
+
+import ast
+import inspect
+import logging
+import math
+import random
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+import transformers
+import typer
+import yaml
+from torch.utils.data import DataLoader
+from transformers import TrainerControl, TrainerState, default_data_collator
+
+import train
+from train import (
+    STOPPING_RULES,
+    ChronosConfig,
+    LearningCurveCallback,
+    create_train_dataset,
+    get_next_path,
+    load_model,
+    save_training_info,
+)
+
+app = typer.Typer(pretty_exceptions_enable=False)
+logger = logging.getLogger(__file__)
+
+# Parameters of train.py that determine the training batches (or are global
+# to the process) and must be the same in all co-trained configs
+SHARED_PARAMS = [
+    "training_data_paths",
+    "probability",
+    "context_length",
+    "prediction_length",
+    "min_past",
+    "max_missing_prop",
+    "shuffle_buffer_length",
+    "shuffle_buffer_bytes",
+    "random_access",
+    "shared_corpus_dir",
+    "data_fraction",
+    "vectorized",
+    "per_device_train_batch_size",
+    "gradient_accumulation_steps",
+    "model_type",
+    "tokenizer_class",
+    "tokenizer_kwargs",
+    "n_tokens",
+    "n_special_tokens",
+    "pad_token_id",
+    "eos_token_id",
+    "use_eos_token",
+    "dataloader_num_workers",
+    "tf32",
+]
+
+# Optimizers of the Trainer that are available here, with the same defaults
+# (betas, eps, no weight decay)
+OPTIMIZERS = ["adamw_torch", "adamw_torch_fused"]
+
+
+def load_config(config_path: str) -> Dict:
+    """
+    Read a training config and fill in the defaults of ``train.main``, with
+    list- and dict-valued parameters given as strings parsed.
+    """
+    config = {
+        name: parameter.default
+        for name, parameter in inspect.signature(train.main).parameters.items()
+        # "config" is the YAML option added by use_yaml_config
+        if parameter.default is not inspect.Parameter.empty and name != "config"
+    }
+    with open(config_path) as fp:
+        config.update(yaml.safe_load(fp))
+
+    for key in ["training_data_paths", "probability", "tokenizer_kwargs"]:
+        if isinstance(config[key], str):
+            config[key] = ast.literal_eval(config[key])
+    if config["probability"] is None:
+        n_paths = len(config["training_data_paths"])
+        config["probability"] = [1.0 / n_paths] * n_paths
+
+    assert len(config["training_data_paths"]) == len(config["probability"])
+    assert 0.0 < config["data_fraction"] <= 1.0
+    assert config["optim"] in OPTIMIZERS, f"optim must be one of {OPTIMIZERS}"
+    assert config["stopping_rule"] is None or config["stopping_rule"] in STOPPING_RULES
+    assert config["validation_data_paths"] is None, "co-trained runs are not validated"
+    return config
+
+
+def get_chronos_config(config: Dict) -> ChronosConfig:
+    return ChronosConfig(
+        tokenizer_class=config["tokenizer_class"],
+        tokenizer_kwargs=config["tokenizer_kwargs"],
+        n_tokens=config["n_tokens"],
+        n_special_tokens=config["n_special_tokens"],
+        pad_token_id=config["pad_token_id"],
+        eos_token_id=config["eos_token_id"],
+        use_eos_token=config["use_eos_token"],
+        model_type=config["model_type"],
+        context_length=config["context_length"],
+        prediction_length=config["prediction_length"],
+        num_samples=config["num_samples"],
+        temperature=config["temperature"],
+        top_k=config["top_k"],
+        top_p=config["top_p"],
+    )
+
+
+def get_device(config: Dict) -> torch.device:
+    """
+    Device to train on, with TF32 matmuls enabled as by the ``Trainer`` if
+    the config asks for them and the GPU supports them.
+    """
+    tf32 = config["tf32"] and (
+        torch.cuda.is_available() and torch.cuda.get_device_capability()[0] >= 8
+    )
+    torch.backends.cuda.matmul.allow_tf32 = tf32
+    torch.backends.cudnn.allow_tf32 = tf32
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def create_model(
+    config: Dict,
+    chronos_config: ChronosConfig,
+    attn_implementation: Optional[str] = None,
+):
+    """
+    Load the model of a config as ``train.py`` does, initialized with the
+    seed of the config (drawn and stored in the config if it has none).
+    """
+    if config["seed"] is None:
+        config["seed"] = random.randint(0, 2**32)
+    transformers.set_seed(seed=config["seed"])
+    model = load_model(
+        model_id=config["model_id"],
+        model_type=config["model_type"],
+        vocab_size=config["n_tokens"],
+        random_init=config["random_init"],
+        tie_embeddings=config["tie_embeddings"],
+        pad_token_id=config["pad_token_id"],
+        eos_token_id=config["eos_token_id"],
+        d_model=config["d_model"],
+        dropout_rate=config["dropout_rate"],
+        feed_forward_proj=config["feed_forward_proj"],
+        layer_norm_epsilon=config["layer_norm_epsilon"],
+        is_encoder_decoder=config["is_encoder_decoder"],
+        num_layers=config["num_layers"],
+        num_heads=config["num_heads"],
+        d_ff=config["d_ff"],
+        attn_implementation=attn_implementation,
+    )
+    model.config.chronos_config = chronos_config.__dict__
+    return model
+
+
+def create_dataloader(
+    config: Dict, chronos_config: ChronosConfig, device: torch.device
+) -> DataLoader:
+    """
+    Training ``DataLoader`` over the shuffled training ``ChronosDataset`` of
+    a config, seeded with its seed, as built by ``train.py``.
+    """
+    transformers.set_seed(seed=config["seed"])
+    train_dataset = create_train_dataset(
+        training_data_paths=config["training_data_paths"],
+        probability=config["probability"],
+        chronos_config=chronos_config,
+        min_past=config["min_past"],
+        max_missing_prop=config["max_missing_prop"],
+        random_access=config["random_access"],
+        shared_corpus_dir=config["shared_corpus_dir"],
+        seed=config["seed"],
+        data_fraction=config["data_fraction"],
+        vectorized=config["vectorized"],
+    )
+    if not config["random_access"]:
+        train_dataset = train_dataset.shuffle(
+            shuffle_buffer_length=config["shuffle_buffer_length"],
+            shuffle_buffer_bytes=config["shuffle_buffer_bytes"],
+        )
+    return DataLoader(
+        train_dataset,
+        batch_size=config["per_device_train_batch_size"],
+        collate_fn=default_data_collator,
+        num_workers=config["dataloader_num_workers"],
+        pin_memory=device.type == "cuda",
+    )
+
+
+def get_learning_curve(
+    config: Dict, run_db: Optional[str], run_id: Optional[int]
+) -> Optional[LearningCurveCallback]:
+    """
+    ``LearningCurveCallback`` (with the stopping rule of the config) that
+    records the learning curve of the run ``run_id``, or None without
+    ``run_db``.
+    """
+    if run_db is None or run_id is None:
+        return None
+    return LearningCurveCallback(
+        run_db,
+        run_id,
+        stopping_rule=(
+            STOPPING_RULES[config["stopping_rule"]](
+                grace_steps=config["stopping_grace_steps"]
+            )
+            if config["stopping_rule"] is not None
+            else None
+        ),
+    )
+
+
+def log_learning_curve(
+    learning_curve: Optional[LearningCurveCallback],
+    step: int,
+    max_steps: int,
+    loss: float,
+) -> bool:
+    """
+    Pass the loss of a logging step to a ``LearningCurveCallback``. Returns
+    True if its stopping rule stops the run.
+    """
+    if learning_curve is None:
+        return False
+    state = TrainerState(global_step=step, max_steps=max_steps)
+    control = TrainerControl()
+    learning_curve.on_log(None, state, control, logs={"loss": loss})
+    return control.should_training_stop
+
+
+def is_checkpoint_step(config: Dict, step: int) -> bool:
+    return any(
+        interval and step % interval == 0
+        for interval in [config["save_steps"], config["snapshot_steps"]]
+    )
+
+
+class CoTrainedModel:
+    """
+    One of the models trained by ``main``, with its optimizer, learning rate
+    schedule and run directory.
+
+    Parameters
+    ----------
+    config
+        Training config of the model, see ``load_config``.
+    chronos_config
+        Chronos config saved with the checkpoints.
+    device
+        Device to train on.
+    run_db
+        Path to the experiment database to write the learning curve to, or
+        None.
+    run_id
+        ``run_id`` of the model's ``TrainingRuns`` row in ``run_db``.
+    """
+
+    def __init__(
+        self,
+        config: Dict,
+        chronos_config: ChronosConfig,
+        device: torch.device,
+        run_db: Optional[str] = None,
+        run_id: Optional[int] = None,
+    ) -> None:
+        self.config = config
+        self.max_steps = config["max_steps"]
+        self.step = 0
+
+        self.model = create_model(config, chronos_config)
+        self.model.to(device)
+        self.model.train()
+        self.forward = (
+            torch.compile(self.model) if config["torch_compile"] else self.model
+        )
+
+        self.optimizer = torch.optim.AdamW(
+            self.model.parameters(),
+            lr=config["learning_rate"],
+            weight_decay=0.0,
+            fused=config["optim"] == "adamw_torch_fused" and device.type == "cuda",
+        )
+        self.scheduler = transformers.get_scheduler(
+            config["lr_scheduler_type"],
+            self.optimizer,
+            num_warmup_steps=math.ceil(config["warmup_ratio"] * self.max_steps),
+            num_training_steps=self.max_steps,
+        )
+
+        self.output_dir = get_next_path(
+            "run", base_dir=Path(config["output_dir"]), file_type=""
+        )
+        self.output_dir.mkdir(parents=True)
+        log_on_main(f"Logging dir: {self.output_dir}")
+
+        self.learning_curve = get_learning_curve(config, run_db, run_id)
+        self.running_loss = 0.0
+        self.running_steps = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.step >= self.max_steps
+
+    def backward(self, batch: Dict[str, torch.Tensor]):
+        loss = self.forward(**batch).loss
+        loss = loss / self.config["gradient_accumulation_steps"]
+        loss.backward()
+        # Kept on the device, so that the models are not synchronized every step
+        self.running_loss += loss.detach()
+
+    def optimizer_step(self) -> bool:
+        """
+        Update the model with the accumulated gradients, log and save it.
+        Returns True if the model should not be trained any further.
+        """
+        # Clipped separately for every model, as the Trainer does
+        torch.nn.utils.clip_grad_norm_(self.model.parameters(), 1.0)
+        self.optimizer.step()
+        self.scheduler.step()
+        self.optimizer.zero_grad(set_to_none=True)
+        self.step += 1
+        self.running_steps += 1
+
+        should_stop = self.step % self.config["log_steps"] == 0 and self.log()
+        if self.finished or should_stop:
+            self.save("checkpoint-final")
+            return True
+        if is_checkpoint_step(self.config, self.step):
+            self.save(f"checkpoint-{self.step}")
+        return False
+
+    def log(self) -> bool:
+        loss = float(self.running_loss) / self.running_steps
+        self.running_loss, self.running_steps = 0.0, 0
+        log_on_main(f"{self.output_dir}: step {self.step}, loss {loss:.4f}")
+        return log_learning_curve(
+            self.learning_curve, self.step, self.max_steps, loss
+        )
+
+    def save(self, name: str):
+        self.model.save_pretrained(self.output_dir / name)
+        save_training_info(self.output_dir / name, training_config=self.config)
+
+
+def log_on_main(msg: str):
+    train.log_on_main(msg, logger)
+
+
+@app.command()
+def main(
+    configs: List[str] = typer.Option(...),
+    run_db: Optional[str] = None,
+    run_ids: Optional[List[int]] = typer.Option(None),
+):
+    configs = [load_config(config_path) for config_path in configs]
+    assert not run_ids or len(run_ids) == len(configs), "one run ID per config"
+    for config in configs[1:]:
+        mismatched = [key for key in SHARED_PARAMS if config[key] != configs[0][key]]
+        assert not mismatched, f"configs can't be co-trained, they differ in {mismatched}"
+    assert train.get_rank_and_world_size()[1] == 1, "co-training uses one process"
+
+    shared = configs[0]
+    device = get_device(shared)
+
+    log_on_main(f"Co-training {len(configs)} models")
+    chronos_configs = [get_chronos_config(config) for config in configs]
+    models = [
+        CoTrainedModel(
+            config,
+            chronos_config,
+            device,
+            run_db=run_db,
+            run_id=run_ids[i] if run_ids else None,
+        )
+        for i, (config, chronos_config) in enumerate(zip(configs, chronos_configs))
+    ]
+
+    # The data stream is seeded with the seed of the first config
+    dataloader = create_dataloader(shared, chronos_configs[0], device)
+
+    log_on_main("Training")
+    start_time = time.perf_counter()
+    active = models
+    for micro_step, batch in enumerate(dataloader, start=1):
+        batch = {key: value.to(device) for key, value in batch.items()}
+        for model in active:
+            model.backward(batch)
+        if micro_step % shared["gradient_accumulation_steps"] == 0:
+            active = [model for model in active if not model.optimizer_step()]
+        if not active:
+            break
+
+    log_on_main(
+        f"Trained {len(models)} models in {time.perf_counter() - start_time:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logger.setLevel(logging.INFO)
+    train.logger.setLevel(logging.INFO)
+    app()
@@ -0,0 +1,340 @@
+"""
+Analytical cost model of a training config: parameter count, training FLOPs
+per step and memory of the T5 model built by ``train.py``, and its predicted
+wall-clock time
+
+    runtime_s = overhead_s + max_steps * (step_overhead_s + flops_per_step * s_per_flop)
+
+with the three coefficients fitted per hardware to the measured
+``TrainingRuns`` times of ``Speedup.db``. The fit is stored in the
+``CostModels`` table, so schedulers and fidelity choices can query it for
+any config (of any experiment database) before launching it:
+
+    model = CostModel.load(sqlite3.connect("Speedup.db"), "a100")
+    model.predict(config)  # {"params": ..., "runtime_s": ..., ...}
+
+Usage: python costModel.py fit --hardware a100
+       python costModel.py predict --hardware a100 --db ../HalvedTrainingTime/MF2.db
+"""
+
+import ast
+import datetime
+import itertools
+import json
+import sqlite3
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import typer
+
+app = typer.Typer(pretty_exceptions_enable=False)
+
+# Defaults of the train.py parameters the cost depends on
+DEFAULTS = {
+    "context_length": 512,
+    "prediction_length": 64,
+    "max_steps": 200000,
+    "per_device_train_batch_size": 32,
+    "gradient_accumulation_steps": 2,
+    "model_id": "google/t5-efficient-tiny",
+    "tie_embeddings": False,
+    "d_model": 512,
+    "num_layers": 6,
+    "num_heads": 8,
+    "d_ff": 2048,
+    "n_tokens": 4096,
+    "use_eos_token": True,
+}
+
+# Properties of the model_id configs that train.py does not override: the
+# decoder keeps the number of layers of model_id, since only num_layers is set,
+# and the feed-forward layers keep its gating, since feed_forward_proj is set
+# after the config has derived is_gated_act from it
+BASE_CONFIGS = {
+    "google/t5-efficient-tiny": {
+        "d_kv": 64,
+        "num_decoder_layers": 4,
+        "relative_attention_num_buckets": 32,
+        "is_gated_act": False,
+    },
+}
+
+BYTES_PER_VALUE = 4  # fp32 weights and activations (TF32 only affects matmuls)
+
+
+def parse_config(config_json: str) -> Dict:
+    """Config of a Configs row (JSON, or a Python dict literal as written by mf2Configs.py) with defaults."""
+    try:
+        config = json.loads(config_json)
+    except ValueError:
+        config = ast.literal_eval(config_json)
+    return {**DEFAULTS, **config}
+
+
+def get_dimensions(config: Dict) -> Dict:
+    """Model, sequence and batch dimensions of a config, with defaults for missing parameters."""
+    config = {**DEFAULTS, **config}
+    base = BASE_CONFIGS[config["model_id"]]
+    eos = 1 if config["use_eos_token"] else 0
+    return {
+        "d": config["d_model"],
+        "d_ff": config["d_ff"],
+        "inner": config["num_heads"] * base["d_kv"],
+        "heads": config["num_heads"],
+        "encoder_layers": config["num_layers"],
+        "decoder_layers": base["num_decoder_layers"],
+        "buckets": base["relative_attention_num_buckets"],
+        "vocab": config["n_tokens"],
+        "tied": config["tie_embeddings"],
+        # Gated activations have two input projections
+        "ff_inputs": 2 if base["is_gated_act"] else 1,
+        "S": config["context_length"] + eos,
+        "T": config["prediction_length"] + eos,
+        "batch_size": config["per_device_train_batch_size"],
+        "accumulation_steps": config["gradient_accumulation_steps"],
+    }
+
+
+def count_parameters(config: Dict) -> int:
+    """Number of parameters of the model of a config."""
+    dims = get_dimensions(config)
+    d, inner = dims["d"], dims["inner"]
+    attention = 4 * d * inner
+    feed_forward = (dims["ff_inputs"] + 1) * d * dims["d_ff"]
+    relative_bias = dims["buckets"] * dims["heads"]
+
+    encoder = dims["encoder_layers"] * (attention + feed_forward + 2 * d) + relative_bias + d
+    decoder = dims["decoder_layers"] * (2 * attention + feed_forward + 3 * d) + relative_bias + d
+    embeddings = dims["vocab"] * d * (1 if dims["tied"] else 2)
+    return encoder + decoder + embeddings
+
+
+def forward_flops(config: Dict) -> float:
+    """FLOPs of the forward pass of one training sample (2 per multiply-add)."""
+    dims = get_dimensions(config)
+    d, inner, S, T = dims["d"], dims["inner"], dims["S"], dims["T"]
+    feed_forward = 2 * (dims["ff_inputs"] + 1) * d * dims["d_ff"]
+
+    encoder_layer = S * (8 * d * inner + feed_forward) + 4 * S * S * inner
+    decoder_layer = (
+        T * (8 * d * inner + feed_forward)  # self-attention projections, feed-forward
+        + 4 * T * T * inner  # self-attention scores and values
+        + T * 4 * d * inner + S * 4 * d * inner  # cross-attention projections
+        + 4 * T * S * inner  # cross-attention scores and values
+    )
+    lm_head = 2 * T * d * dims["vocab"]
+    return dims["encoder_layers"] * encoder_layer + dims["decoder_layers"] * decoder_layer + lm_head
+
+
+def training_flops_per_step(config: Dict) -> float:
+    """FLOPs of one optimizer step: forward and backward (twice the forward) over all micro-batches."""
+    dims = get_dimensions(config)
+    return 3 * forward_flops(config) * dims["batch_size"] * dims["accumulation_steps"]
+
+
+def activation_memory_bytes(config: Dict) -> float:
+    """Estimate of the activations kept for the backward pass of one micro-batch."""
+    dims = get_dimensions(config)
+    d, inner, S, T = dims["d"], dims["inner"], dims["S"], dims["T"]
+    feed_forward = (dims["ff_inputs"] + 2) * dims["d_ff"]  # projections, activation, dropout
+
+    # Layer norm in- and outputs, q/k/v/attention output, residuals; scores,
+    # probabilities and dropout mask of every head
+    encoder_layer = S * (5 * d + 4 * inner + feed_forward) + 3 * dims["heads"] * S * S
+    decoder_layer = (
+        T * (7 * d + 6 * inner + feed_forward)
+        + 2 * S * inner
+        + 3 * dims["heads"] * (T * T + T * S)
+    )
+    logits = 3 * T * dims["vocab"]  # logits, log-probabilities and their gradient
+    values = dims["encoder_layers"] * encoder_layer + dims["decoder_layers"] * decoder_layer + logits
+    return BYTES_PER_VALUE * values * dims["batch_size"]
+
+
+def training_memory_bytes(config: Dict) -> float:
+    """Estimate of the peak training memory: weights, gradients, two AdamW moments and activations."""
+    return 4 * BYTES_PER_VALUE * count_parameters(config) + activation_memory_bytes(config)
+
+
+def fit_nonnegative(features: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """Least squares fit with non-negative coefficients, over all subsets of the (few) features."""
+    # Features of very different magnitude (steps vs. FLOPs) are solved for on a common scale
+    scale = np.abs(features).max(axis=0)
+    scale[scale == 0] = 1.0
+    features = features / scale
+    best_error, best_coef = np.inf, np.zeros(features.shape[1])
+    for subset in itertools.product([False, True], repeat=features.shape[1]):
+        columns = np.flatnonzero(subset)
+        if len(columns) == 0:
+            continue
+        coef, *_ = np.linalg.lstsq(features[:, columns], targets, rcond=None)
+        if (coef < 0).any():
+            continue
+        full_coef = np.zeros(features.shape[1])
+        full_coef[columns] = coef
+        error = ((features @ full_coef - targets) ** 2).sum()
+        if error < best_error:
+            best_error, best_coef = error, full_coef
+    return best_coef / scale
+
+
+class CostModel:
+    """
+    Predicted runtime and memory of training configs, with the per-hardware
+    time coefficients of the module docstring.
+
+    Parameters
+    ----------
+    overhead_s
+        Time per run that does not depend on the steps (imports, model and
+        data setup, compilation, shuffle buffer warm-up).
+    step_overhead_s
+        Time per step that does not depend on the FLOPs (data loading,
+        kernel launches, optimizer), which dominates for small models.
+    s_per_flop
+        Time per training FLOP, the inverse of the achieved FLOP/s.
+    """
+
+    def __init__(self, overhead_s: float, step_overhead_s: float, s_per_flop: float) -> None:
+        self.overhead_s = overhead_s
+        self.step_overhead_s = step_overhead_s
+        self.s_per_flop = s_per_flop
+
+    @classmethod
+    def fit(cls, connection: sqlite3.Connection) -> "CostModel":
+        """Fit the coefficients to the finished runs of an experiment database, minimizing the relative error."""
+        runs = get_finished_runs(connection)
+        assert len(runs) > 0, "no finished runs to fit the cost model to"
+        steps = runs["max_steps"].to_numpy(dtype=float)
+        features = np.stack(
+            [np.ones_like(steps), steps, steps * runs["flops_per_step"].to_numpy(dtype=float)], axis=1
+        )
+        targets = runs["training_time_s"].to_numpy(dtype=float)
+        coef = fit_nonnegative(features / targets[:, None], np.ones_like(targets))
+        return cls(*coef)
+
+    @classmethod
+    def load(cls, connection: sqlite3.Connection, hardware: str) -> "CostModel":
+        """Cost model fitted for ``hardware``, from the CostModels table."""
+        row = connection.execute(
+            "SELECT overhead_s, step_overhead_s, s_per_flop FROM CostModels WHERE hardware = ?",
+            (hardware,),
+        ).fetchone()
+        assert row is not None, f"no cost model fitted for hardware {hardware}"
+        return cls(*row)
+
+    def save(self, connection: sqlite3.Connection, hardware: str, num_runs: int, mape: float):
+        with connection:
+            connection.execute(
+                """
+                INSERT OR REPLACE INTO CostModels
+                (hardware, overhead_s, step_overhead_s, s_per_flop, num_runs, mape, fitted_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    hardware, self.overhead_s, self.step_overhead_s, self.s_per_flop,
+                    num_runs, mape, datetime.datetime.now(),
+                ),
+            )
+
+    def predict_runtime_s(self, config: Dict) -> float:
+        return self.overhead_s + config.get("max_steps", DEFAULTS["max_steps"]) * (
+            self.step_overhead_s + training_flops_per_step(config) * self.s_per_flop
+        )
+
+    def predict(self, config: Dict) -> Dict:
+        """Parameter count, training FLOPs per step, memory and runtime of a config."""
+        return {
+            "params": count_parameters(config),
+            "flops_per_step": training_flops_per_step(config),
+            "activation_memory_bytes": activation_memory_bytes(config),
+            "memory_bytes": training_memory_bytes(config),
+            "runtime_s": self.predict_runtime_s(config),
+        }
+
+
+def get_finished_runs(connection: sqlite3.Connection) -> pd.DataFrame:
+    """
+    Finished runs that trained alone for max_steps, with their config, training FLOPs per step
+    and measured wall-clock time.
+    """
+    tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    run_columns = {row[1] for row in connection.execute("PRAGMA table_info(TrainingRuns)")}
+    conditions = ["r.start_time IS NOT NULL", "r.end_time IS NOT NULL"]
+    if "group_id" in run_columns:
+        # Co-trained runs (speedupRunsMulti.py) share the wall-clock time of their group
+        conditions.append("r.group_id IS NULL")
+    if "EarlyStops" in tables:
+        # Runs ended by the stopping rule did not train for max_steps
+        conditions.append("r.run_id NOT IN (SELECT run_id FROM EarlyStops)")
+    runs = pd.read_sql_query(
+        f"""
+        SELECT r.run_id, r.config_id, r.start_time, r.end_time, c.config_json
+        FROM TrainingRuns r JOIN Configs c ON r.config_id = c.config_id
+        WHERE {" AND ".join(conditions)}
+        """,
+        connection,
+    )
+    configs = runs["config_json"].map(parse_config)
+    runs["max_steps"] = configs.map(lambda config: config["max_steps"])
+    runs["flops_per_step"] = configs.map(training_flops_per_step)
+    runs["training_time_s"] = (
+        pd.to_datetime(runs["end_time"]) - pd.to_datetime(runs["start_time"])
+    ).dt.total_seconds()
+    return runs
+
+
+@app.command()
+def fit(
+    hardware: str = typer.Option(...),
+    db: str = "Speedup.db",
+):
+    """Fit the cost model to the finished runs in db and store it for hardware."""
+    connection = sqlite3.connect(db, timeout=30)
+    model = CostModel.fit(connection)
+    runs = get_finished_runs(connection)
+    predicted = runs["config_json"].map(lambda config_json: model.predict_runtime_s(parse_config(config_json)))
+    mape = float((abs(predicted - runs["training_time_s"]) / runs["training_time_s"]).mean())
+    model.save(connection, hardware, num_runs=len(runs), mape=mape)
+    connection.close()
+
+    achieved = f"{1 / model.s_per_flop / 1e12:.2f} TFLOP/s" if model.s_per_flop > 0 else "not FLOP-bound"
+    print(
+        f"Fitted cost model for {hardware} on {len(runs)} runs: overhead {model.overhead_s:.1f}s, "
+        f"{model.step_overhead_s * 1e3:.2f}ms per step, {achieved}, mean relative error {mape:.1%}"
+    )
+
+
+@app.command()
+def predict(
+    hardware: str = typer.Option(...),
+    db: str = "Speedup.db",
+    model_db: str = "Speedup.db",
+    config_ids: Optional[List[int]] = typer.Option(None),
+    output: Optional[str] = None,
+):
+    """Predict parameters, FLOPs, memory and runtime of the configs in db (all, or config_ids)."""
+    model_connection = sqlite3.connect(model_db, timeout=30)
+    model = CostModel.load(model_connection, hardware)
+    model_connection.close()
+
+    connection = sqlite3.connect(db, timeout=30)
+    configs = pd.read_sql_query("SELECT config_id, config_json FROM Configs", connection)
+    connection.close()
+    if config_ids:
+        configs = configs[configs["config_id"].isin(config_ids)]
+
+    predictions = pd.DataFrame(
+        [
+            {"config_id": config_id, **model.predict(parse_config(config_json))}
+            for config_id, config_json in zip(configs["config_id"], configs["config_json"])
+        ]
+    )
+    if output is not None:
+        predictions.to_csv(output, index=False)
+    print(predictions.to_string(index=False))
+
+
+if __name__ == "__main__":
+    app()
@@ -46,7 +46,7 @@ fixed_config = {
     "d_ff": 2048
 }
 
-scaling_methods = ["d_ff", "num_heads", "num_layers", "context_length", "n_tokens", "max_steps", "d_model", "d_ff_d_model"]
+scaling_methods = ["d_ff", "num_heads", "num_layers", "context_length", "n_tokens", "max_steps", "d_model", "d_ff_d_model", "data_fraction"]
 
 # Scaling values
 scaling_values = {
@@ -62,6 +62,10 @@ scaling_values = {
 # Define d_ff_d_model scaling by pairing corresponding values
 scaling_values["d_ff_d_model"] = list(zip(scaling_values["d_ff"], scaling_values["d_model"]))   #62
 
+# Fraction of the series of every training file used for training (hash-based subset, see train.py);
+# the full corpus (train.py's default) is the baseline config of the other methods
+scaling_values["data_fraction"] = [0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 0.6]                      #69
+
 # Connect to the database
 connection = sqlite3.connect("Speedup.db")
 cursor = connection.cursor()
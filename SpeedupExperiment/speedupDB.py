@@ -29,10 +29,98 @@ CREATE TABLE IF NOT EXISTS TrainingRuns (
     config_id INTEGER NOT NULL,
     start_time TIMESTAMP,
     end_time TIMESTAMP,
+    group_id INTEGER, -- first run_id of the runs co-trained by speedupRunsMulti.py, NULL for single runs
     FOREIGN KEY (config_id) REFERENCES Configs(config_id)
 );
 """)
 
+# Add columns to TrainingRuns tables created before them
+columns = [row[1] for row in cursor.execute("PRAGMA table_info(TrainingRuns)")]
+if "group_id" not in columns:
+    cursor.execute("ALTER TABLE TrainingRuns ADD COLUMN group_id INTEGER")
+
+# Create the TrainingPhases table: wall-clock time of each phase of a run (seconds),
+# written by train.py --run-db --run-id
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS TrainingPhases (
+    run_id INTEGER PRIMARY KEY,
+    import_s REAL,
+    model_load_s REAL, -- model init incl. config download
+    dataset_s REAL,
+    trainer_init_s REAL,
+    first_data_wait_s REAL, -- dataloader start-up and shuffle buffer warm-up
+    first_compute_s REAL, -- incl. torch_compile compilation
+    warmup_s REAL, -- all steps excluded from the steady state
+    checkpoint_s REAL,
+    eval_s REAL, -- in-training validation, if enabled
+    train_s REAL,
+    total_s REAL,
+    steady_steps INTEGER,
+    steady_data_wait_s REAL, -- mean per optimizer step
+    steady_compute_s REAL, -- mean per optimizer step
+    steady_samples_per_s REAL,
+    FOREIGN KEY (run_id) REFERENCES TrainingRuns(run_id)
+);
+""")
+
+# Add columns to TrainingPhases tables created before them
+columns = [row[1] for row in cursor.execute("PRAGMA table_info(TrainingPhases)")]
+if "eval_s" not in columns:
+    cursor.execute("ALTER TABLE TrainingPhases ADD COLUMN eval_s REAL")
+
+# Create the StepTimes table: mean step time decomposition per logging interval
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS StepTimes (
+    step_time_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL,
+    training_step INTEGER NOT NULL, -- last step of the interval
+    num_steps INTEGER NOT NULL,
+    data_wait_s REAL NOT NULL,
+    compute_s REAL NOT NULL,
+    samples_per_s REAL NOT NULL,
+    FOREIGN KEY (run_id) REFERENCES TrainingRuns(run_id)
+);
+""")
+
+# Create the CostModels table: runtime coefficients of costModel.py, fitted per hardware
+# to the TrainingRuns times
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS CostModels (
+    hardware TEXT PRIMARY KEY,
+    overhead_s REAL NOT NULL, -- per run
+    step_overhead_s REAL NOT NULL, -- per step, independent of the FLOPs
+    s_per_flop REAL NOT NULL, -- inverse of the achieved training FLOP/s
+    num_runs INTEGER NOT NULL,
+    mape REAL, -- mean relative error of the fitted runtimes
+    fitted_at TIMESTAMP
+);
+""")
+
+# Create the LearningCurves table: loss at every logging step, written by
+# train.py --run-db --run-id while training
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS LearningCurves (
+    curve_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL,
+    training_step INTEGER NOT NULL,
+    loss REAL, -- mean training loss since the previous logging step
+    eval_loss REAL, -- held-out loss, if the run is evaluated
+    UNIQUE (run_id, training_step),
+    FOREIGN KEY (run_id) REFERENCES TrainingRuns(run_id)
+);
+""")
+
+# Create the EarlyStops table: runs ended early by the stopping rule of train.py
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS EarlyStops (
+    run_id INTEGER PRIMARY KEY,
+    training_step INTEGER NOT NULL,
+    stopping_rule TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    FOREIGN KEY (run_id) REFERENCES TrainingRuns(run_id)
+);
+""")
+
 # Commit the changes and close the connection
 connection.commit()
 connection.close()
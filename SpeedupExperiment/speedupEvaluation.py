@@ -10,13 +10,26 @@ cursor = connection.cursor()
 configs_df = pd.read_sql_query("SELECT * FROM Configs", connection)
 runs_df = pd.read_sql_query("SELECT * FROM TrainingRuns WHERE start_time IS NOT NULL AND end_time IS NOT NULL", connection)
 
+# Co-trained runs (speedupRunsMulti.py) share the wall-clock time of their group, so it is
+# not the training time of their config
+if "group_id" in runs_df.columns:
+    runs_df = runs_df[runs_df["group_id"].isna()].drop(columns="group_id")
+
 # Compute training times
 runs_df["training_time"] = pd.to_datetime(runs_df["end_time"]) - pd.to_datetime(runs_df["start_time"])
 
+# Steady-state throughput recorded by train.py (without imports, compilation, warm-up and checkpointing)
+tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type = 'table'", connection)["name"]
+if "TrainingPhases" in set(tables):
+    phases_df = pd.read_sql_query("SELECT run_id, steady_samples_per_s FROM TrainingPhases", connection)
+    runs_df = runs_df.merge(phases_df, on="run_id", how="left")
+else:
+    runs_df["steady_samples_per_s"] = float("nan")
+
 # Default values for each scaling parameter
 defaults = {
     "d_ff": 2048, "num_heads": 8, "num_layers": 6, "context_length": 512,
-    "n_tokens": 4096, "max_steps": 200000, "d_model": 512
+    "n_tokens": 4096, "max_steps": 200000, "d_model": 512, "data_fraction": 1.0
 }
 
 # Parse config JSON and extract modified parameters
@@ -60,10 +73,10 @@ default_configs["scaling_parameter"] = default_configs["scaling_parameter"].fill
 df = runs_df.merge(configs_df, on="config_id")
 
 # Select relevant columns
-final_df = df[["run_id", "config_id", "scaling_parameter", "value_of_scaling_parameter", "training_time"]]
+final_df = df[["run_id", "config_id", "scaling_parameter", "value_of_scaling_parameter", "training_time", "steady_samples_per_s"]]
 
 # Drop rows where no parameter was scaled
-final_df = final_df.dropna()
+final_df = final_df.dropna(subset=["scaling_parameter", "value_of_scaling_parameter", "training_time"])
 
 # Add the default training time for each scaling parameter
 default_entries = []
@@ -79,7 +92,8 @@ for param in defaults.keys():
             "config_id": default_config_id,
             "scaling_parameter": param,
             "value_of_scaling_parameter": defaults[param],  # Use default value for reference
-            "training_time": default_time
+            "training_time": default_time,
+            "steady_samples_per_s": default_run.iloc[0]["steady_samples_per_s"]
         })
 
 # Append default entries to the DataFrame
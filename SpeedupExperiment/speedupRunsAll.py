@@ -33,6 +33,9 @@ def train_model(config_id, config_json):
 
     # Convert config JSON to dictionary
     config = json.loads(config_json)  
+    # Every invocation is timed as a new run, so an earlier killed run of this
+    # config must not be continued
+    config["resume"] = False
 
     # Create a temporary YAML config file
     with tempfile.TemporaryDirectory() as temp_dir:
@@ -42,7 +45,11 @@ def train_model(config_id, config_json):
 
         # Run training
         result = subprocess.run(
-            ["python3", TRAIN_SCRIPT, "--config", yaml_path],
+            [
+                "python3", TRAIN_SCRIPT, "--config", yaml_path,
+                # Record the step time decomposition for this run
+                "--run-db", os.path.abspath(DB_PATH), "--run-id", str(run_id),
+            ],
             capture_output=True,
             text=True
         )
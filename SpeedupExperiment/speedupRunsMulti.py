@@ -0,0 +1,130 @@
+import sqlite3
+import yaml
+import os
+import subprocess
+import sys
+import tempfile
+import datetime
+import json
+import time
+
+
+def train_models(config_ids, config_jsons):
+    """Co-trains several configurations in one process and logs start/end time of each in DB."""
+
+    DB_PATH = "Speedup.db"
+    TRAIN_SCRIPT = "chronos-forecasting/scripts/training/train_multi.py"
+
+    # Connect to database with a busy timeout to avoid locking errors
+    connection = sqlite3.connect(DB_PATH, timeout=30)  # 30 seconds timeout
+    cursor = connection.cursor()
+
+    # Record the start time
+    start_time = datetime.datetime.now()
+    print(f"Co-training started for config IDs: {config_ids} at {start_time}")
+
+    # Every co-trained model gets its own TrainingRuns row; the rows of the group are
+    # marked with its first run_id, since their times are not those of single runs
+    run_ids = []
+    for config_id in config_ids:
+        cursor.execute(
+            "INSERT INTO TrainingRuns (config_id, start_time) VALUES (?, ?)",
+            (config_id, start_time),
+        )
+        run_ids.append(cursor.lastrowid)
+    for run_id in run_ids:
+        cursor.execute(
+            "UPDATE TrainingRuns SET group_id = ? WHERE run_id = ?",
+            (run_ids[0], run_id),
+        )
+    connection.commit()
+
+    # Create a temporary YAML config file per configuration
+    with tempfile.TemporaryDirectory() as temp_dir:
+        command = ["python3", TRAIN_SCRIPT]
+        for config_id, config_json in zip(config_ids, config_jsons):
+            yaml_path = os.path.join(temp_dir, f"config_run_{config_id}.yaml")
+            with open(yaml_path, "w") as yaml_file:
+                yaml.dump(json.loads(config_json), yaml_file)
+            command += ["--configs", yaml_path]
+
+        # Record the learning curve of every run
+        command += ["--run-db", os.path.abspath(DB_PATH)]
+        for run_id in run_ids:
+            command += ["--run-ids", str(run_id)]
+
+        # Run training
+        result = subprocess.run(command, capture_output=True, text=True)
+
+        # Check for errors
+        if result.returncode != 0:
+            print(f"Co-training failed for config IDs: {config_ids}. Error: {result.stderr}")
+            connection.close()
+            return
+
+    # Record the end time; the models share it, since they are trained together
+    end_time = datetime.datetime.now()
+    print(f"Co-training completed for config IDs: {config_ids} at {end_time}")
+
+    # Update the TrainingRuns table with end time
+    for run_id in run_ids:
+        cursor.execute(
+            "UPDATE TrainingRuns SET end_time = ? WHERE run_id = ?",
+            (end_time, run_id),
+        )
+
+    # Commit DB changes
+    connection.commit()
+    connection.close()
+
+
+def main():
+    """Fetches the given configurations from Speedup.db and co-trains them in one process."""
+
+    # Ensure config_ids are provided
+    if len(sys.argv) < 2:
+        print("Usage: python speedupRunsMulti.py <config_id> [<config_id> ...]")
+        sys.exit(1)
+
+    config_ids = [int(arg) for arg in sys.argv[1:]]
+
+    DB_PATH = "Speedup.db"
+
+    # Connect to DB with a retry mechanism and timeout
+    connection = sqlite3.connect(DB_PATH, timeout=30)  # 30 seconds timeout
+    cursor = connection.cursor()
+
+    # Fetch the configurations for the given config_ids
+    config_jsons = []
+    retry_attempts = 3
+    for config_id in config_ids:
+        for attempt in range(retry_attempts):
+            try:
+                cursor.execute("SELECT config_json FROM Configs WHERE config_id = ?", (config_id,))
+                config = cursor.fetchone()
+
+                if not config:
+                    print(f"No configuration found for config_id: {config_id}")
+                    sys.exit(1)
+
+                config_jsons.append(config[0])
+                break
+            except sqlite3.OperationalError as e:
+                if attempt < retry_attempts - 1:
+                    print(f"Database is locked, retrying ({attempt + 1}/{retry_attempts})...")
+                    time.sleep(5)  # wait 5 seconds before retrying
+                else:
+                    print(f"Failed to fetch configuration after {retry_attempts} attempts. Error: {e}")
+                    sys.exit(1)
+
+    # Close the DB connection
+    connection.close()
+
+    print(f"Starting co-training for config IDs: {config_ids}")
+
+    # Call the function to train the models with the fetched configurations
+    train_models(config_ids, config_jsons)
+
+
+if __name__ == "__main__":
+    main()